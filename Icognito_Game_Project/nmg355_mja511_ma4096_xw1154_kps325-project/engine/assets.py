@@ -0,0 +1,84 @@
+import os, struct, hashlib, logging, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+from core import Image, load_surface
+
+# Cached sprites are raw RGBA pixels behind a small header:
+#   'INCS' | width (I) | height (I) | pixels
+MAGIC = b'INCS'
+CACHE_VERSION = 1
+
+class AssetManager(object):
+    # Sprites are decoded (or rasterised) and scaled once, then cached on disk
+    # as raw pixels under a hash of the source file and the scale, so a warm
+    # start skips PNG decoding, SVG rasterising and resampling. Loads run on a
+    # thread pool, and identical requests share a single Image, which must
+    # therefore not be resized by its users. Big one-off images such as
+    # monolithic level backgrounds are loaded with cache=False: as raw pixels
+    # they would be a multi-megabyte file to read and hash on every start.
+    def __init__(self, cache_dir='.cache/sprites', workers=4):
+        self.cache_dir = cache_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending = {}
+        self._images = {}
+
+    def preload(self, requests, cache=True):
+        # Start loading (path, scale) pairs without waiting for them
+        for path, scale in requests:
+            self._submit(path, scale, cache)
+
+    def load(self, path, scale=None, cache=True):
+        key = (path, scale)
+        if key not in self._images:
+            size, pixels = self._submit(path, scale, cache).result()
+            # convert_alpha needs the display, so it happens on this thread
+            surface = pygame.image.fromstring(pixels, size, 'RGBA').convert_alpha()
+            self._images[key] = Image.from_surface(surface, path)
+        return self._images[key]
+
+    def _submit(self, path, scale, cache=True):
+        key = (path, scale)
+        if key not in self._pending:
+            self._pending[key] = self.executor.submit(self._load_pixels, path, scale, cache)
+        return self._pending[key]
+
+    def _cache_path(self, path, scale):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as source:
+            digest.update(source.read())
+        digest.update('{}:{!r}'.format(CACHE_VERSION, scale).encode('ascii'))
+        return os.path.join(self.cache_dir, digest.hexdigest() + '.rgba')
+
+    def _load_pixels(self, path, scale, cache=True):
+        cache_path = self._cache_path(path, scale) if cache else None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as cached:
+                data = cached.read()
+            if data[:4] == MAGIC:
+                width, height = struct.unpack_from('<II', data, 4)
+                return (width, height), data[12:]
+
+        surface = load_surface(path)
+        if scale is not None:
+            surface = pygame.transform.scale(surface, (int(surface.get_width() * scale), int(surface.get_height() * scale)))
+        size = surface.get_size()
+        pixels = pygame.image.tostring(surface, 'RGBA')
+        if not cache:
+            return size, pixels
+
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                pass # Another loader thread got there first
+        try:
+            # Write to a temporary file first so readers never see half a sprite
+            handle, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(handle, 'wb') as cached:
+                cached.write(MAGIC + struct.pack('<II', size[0], size[1]))
+                cached.write(pixels)
+            os.rename(temp_path, cache_path)
+        except (IOError, OSError):
+            logging.warning('Could not write sprite cache for {}'.format(path))
+        return size, pixels
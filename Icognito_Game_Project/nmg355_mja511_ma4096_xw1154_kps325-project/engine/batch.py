@@ -0,0 +1,247 @@
+try:
+    import numpy
+    NUMPY_ENABLED = True
+except ImportError:
+    NUMPY_ENABLED = False
+
+import logging
+from characters import Direction
+
+class EnemyBatch(object):
+    # Structure-of-arrays copy of a list of PatrollingEnemy objects. Patrols
+    # and line of sight for every enemy are computed with a handful of NumPy
+    # operations per tick; the objects themselves are only written back when
+    # something needs them (rendering, detection).
+    def __init__(self, enemies):
+        if not NUMPY_ENABLED:
+            logging.warning('Batched enemies not supported: install numpy')
+            raise ImportError('numpy is required for EnemyBatch')
+
+        self.enemies = list(enemies)
+        self.reload()
+
+    def reload(self):
+        # (Re)build the arrays from the enemy objects
+        enemies = self.enemies
+        # Keep integer positions integral so results match the object path exactly
+        dtype = numpy.array([e.x for e in enemies] + [e.speed for e in enemies] + [0]).dtype
+        self.x = numpy.array([e.x for e in enemies], dtype=dtype)
+        self.prev_x = self.x.copy()
+        self.y = numpy.array([e.y for e in enemies], dtype=dtype)
+        self.width = numpy.array([e.width for e in enemies], dtype=dtype)
+        self.facing = numpy.array([e.facing for e in enemies], dtype=numpy.int8)
+        self.speed = numpy.array([e.speed for e in enemies], dtype=dtype)
+        self.patrol_left = numpy.array([e.patrol_area_left for e in enemies], dtype=dtype)
+        self.patrol_right = numpy.array([e.patrol_area_right for e in enemies], dtype=dtype)
+        self.view_distance = numpy.array([e.view_distance for e in enemies], dtype=dtype)
+        self.detected = numpy.array([e.detected_image is not None and e.image is e.detected_image for e in enemies], dtype=bool)
+
+    def __len__(self):
+        return len(self.enemies)
+
+    def append(self, enemy):
+        self.sync_all()
+        self.enemies.append(enemy)
+        self.reload()
+
+    def remove(self, enemy):
+        self.sync_all()
+        self.enemies.remove(enemy)
+        self.reload()
+
+    def move(self):
+        # PatrollingEnemy.move for every enemy at once
+        turning = (self.x < self.patrol_left) | (self.x > self.patrol_right + self.width)
+        self.facing[turning] *= -1
+        self.prev_x = self.x.copy()
+        self.x += self.facing * self.speed
+
+    def can_see(self, player):
+        # Enemy.can_see for every enemy at once, returns a boolean mask
+        if not player.visible:
+            seen = numpy.zeros(len(self.enemies), dtype=bool)
+        else:
+            seen = self._sight(player.x, player.x + player.width, player.y)
+        self.detected = seen
+        return seen
+
+    def sees(self, x, y, width, visible, block=4096):
+        # For arrays of many players, whether any enemy can see each one.
+        # Players are checked a block at a time to bound the players x enemies matrix.
+        spotted = numpy.zeros(len(x), dtype=bool)
+        if not len(self.enemies):
+            return spotted
+        step = max(1, block * block // len(self.enemies))
+        for start in xrange(0, len(x), step):
+            end = start + step
+            left = x[start:end, None]
+            spotted[start:end] = self._sight(left, left + width, y[start:end, None]).any(axis=1)
+        return spotted & visible
+
+    def _sight(self, left_edge, right_edge, y):
+        # Broadcasts, so the edges can be scalars or columns of player values
+        near = numpy.abs(y - self.y) < 60
+        looking_left = (
+            (left_edge < self.x) & (left_edge > self.x - self.view_distance)
+        ) | (
+            (right_edge < self.x) & (right_edge > self.x - self.view_distance)
+        )
+        looking_right = (
+            (left_edge > self.x) & (left_edge < self.x + self.view_distance)
+        ) | (
+            (right_edge > self.x) & (right_edge < self.x + self.view_distance)
+        )
+        return near & numpy.where(self.facing == Direction.LEFT, looking_left,
+                                  (self.facing == Direction.RIGHT) & looking_right)
+
+    def step(self, player):
+        # Advance every patrol and return the indices of enemies that see the player
+        self.move()
+        return numpy.flatnonzero(self.can_see(player))
+
+    def in_range(self, left, right):
+        # Indices of enemies whose extent overlaps [left, right)
+        return numpy.flatnonzero((self.x + self.width > left) & (self.x < right))
+
+    def sync(self, index):
+        # Write the batched state back to the enemy object and return it
+        enemy = self.enemies[index]
+        enemy.x = self.x[index].item()
+        enemy.prev_x = self.prev_x[index].item()
+        enemy.facing = int(self.facing[index])
+        if self.detected[index] and enemy.detected_image:
+            enemy.image = enemy.detected_image
+        else:
+            enemy.image = enemy.normal_image
+        return enemy
+
+    def sync_all(self):
+        for index in xrange(len(self.enemies)):
+            self.sync(index)
+
+
+class AgentBatch(object):
+    # Many independent players running through one level at once, for bots.
+    # Each agent has its own position, jump, cloak, visibility and camera. The
+    # enemy patrols are shared and stepped once per tick, and every agent is
+    # checked against every enemy in a single array expression. Agents follow
+    # the same rules as World.player under Engine.step, except that statics
+    # are ignored and a streamed level is loaded and kept awake in full.
+    RUNNING = 0
+    WIN = 1
+    LOSE = 2
+
+    def __init__(self, world, count):
+        if not NUMPY_ENABLED:
+            logging.warning('Batched agents not supported: install numpy')
+            raise ImportError('numpy is required for AgentBatch')
+
+        engine = world.engine
+        engine.populate(world)
+        if world.level is not None:
+            world.level.stream_to(float('inf'))
+        self.world = world
+        self.enemies = EnemyBatch(world.all_enemies())
+
+        player = world.player
+        self.count = count
+        self.player_width = player.width
+        self.player_height = player.height
+        self.speed = player.speed
+        self.jump_speed = -world.gravity * 15
+        self.left_cutoff = engine.width*1/3
+        self.right_cutoff = engine.width*2/3
+        self.screen_width = engine.width
+
+        self.x = numpy.full(count, player.x, dtype=numpy.int64)
+        self.y = numpy.full(count, player.y, dtype=numpy.int64)
+        self.dy = numpy.full(count, player.dy, dtype=numpy.int64)
+        self.camera_x = numpy.full(count, world.x, dtype=numpy.int64)
+        self.facing = numpy.full(count, player.facing, dtype=numpy.int8)
+        self.jumping = numpy.full(count, player.jumping, dtype=bool)
+        self.visible = numpy.full(count, player.visible, dtype=bool)
+        self.cloak = numpy.full(count, player.cloak, dtype=float)
+
+        pickups = list(world.medkits)
+        self.medkit_x = numpy.array([pickup.x for pickup in pickups], dtype=numpy.int64)
+        self.taken = numpy.zeros((count, len(pickups)), dtype=bool)
+
+        self.outcome = numpy.zeros(count, dtype=numpy.int8)
+        self.frames = numpy.zeros(count, dtype=numpy.int64)
+        self.spotted = numpy.zeros(count, dtype=bool)
+        self.detected_x = numpy.zeros(count, dtype=numpy.int64)
+        self.detected_y = numpy.zeros(count, dtype=numpy.int64)
+
+    def move(self, mask, dx, dy):
+        # World.move_player for the agents in mask
+        world = self.world
+        self.x = numpy.where(mask, numpy.clip(self.x + dx, 0, world.width - self.player_width), self.x)
+        y = numpy.maximum(self.y + dy, world.floor)
+        self.y = numpy.where(mask, numpy.minimum(y, world.height - self.player_height), self.y)
+
+        screen_x = self.x - self.camera_x
+        camera_x = numpy.where(screen_x < self.left_cutoff, self.x - self.left_cutoff,
+                               numpy.where(screen_x + self.player_width > self.right_cutoff,
+                                           self.x - self.right_cutoff + self.player_width, self.camera_x))
+        camera_x = numpy.minimum(numpy.maximum(camera_x, 0), world.width - self.screen_width)
+        self.camera_x = numpy.where(mask, camera_x, self.camera_x)
+
+    def step(self, walk, jump, hide):
+        # walk holds -1, 0 or 1 per agent, jump and hide are boolean arrays.
+        # Agents that have won or lost are left alone.
+        world = self.world
+        live = self.outcome == self.RUNNING
+        self.frames += live
+
+        # Key handlers run first and see the visibility from the previous tick
+        jumping = live & self.visible & jump & ~self.jumping
+        self.dy[jumping] = self.jump_speed
+        self.jumping |= jumping
+        self.move(jumping, 0, self.dy)
+        walking = live & self.visible & (walk != 0)
+        self.move(walking, walk * self.speed, 0)
+        self.facing = numpy.where(walking, walk, self.facing)
+
+        # World.tick
+        airborne = live & (self.y > world.floor)
+        self.move(airborne, 0, self.dy)
+        self.dy[airborne] += world.gravity
+        landed = airborne & (self.y <= world.floor)
+        self.dy[landed] = 0
+        self.jumping[landed] = False
+
+        self.visible = numpy.where(live, ~hide, self.visible)
+        self.cloak[live & hide] -= 0.5
+
+        right = self.x + self.player_width
+        reached = live[:, None] & ~self.taken & (right[:, None] >= self.medkit_x)
+        self.cloak += 50 * reached.sum(axis=1)
+        self.taken |= reached
+
+        self.enemies.move()
+        seen = live & self.enemies.sees(self.x, self.y, self.player_width, self.visible)
+        first = seen & ~self.spotted
+        self.detected_x[first] = self.x[first]
+        self.detected_y[first] = self.y[first]
+        self.spotted |= seen
+
+        # Same order as Engine.step: detection, then the finish line, then the cloak
+        self.outcome[seen] = self.LOSE
+        self.outcome[live & (right > world.width - 50)] = self.WIN
+        self.outcome[live & (self.cloak <= 0)] = self.LOSE
+        return self.outcome
+
+    def run(self, policy, max_frames=100000):
+        # policy(frame) returns the (walk, jump, hide) arrays for that frame
+        frame = 0
+        while frame < max_frames and (self.outcome == self.RUNNING).any():
+            self.step(*policy(frame))
+            frame += 1
+        return self.results()
+
+    def results(self):
+        from core import Engine, EpisodeResult
+        outcomes = {self.RUNNING: None, self.WIN: Engine.WIN, self.LOSE: Engine.LOSE}
+        return [EpisodeResult(outcomes[self.outcome[i]], self.frames[i].item(), self.cloak[i].item(),
+                              (self.detected_x[i].item(), self.detected_y[i].item()) if self.spotted[i] else None)
+                for i in xrange(self.count)]
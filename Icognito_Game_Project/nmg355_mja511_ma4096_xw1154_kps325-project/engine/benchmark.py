@@ -0,0 +1,670 @@
+import os, sys, json, timeit, random, collections
+
+# Benchmarks run without a window
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from core import *
+import characters
+
+BENCHMARKS = collections.OrderedDict()
+# Timings (ms) measured under a key, for --json and --baseline
+RESULTS = collections.OrderedDict()
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def measure(func, repeat=5, number=100, key=None):
+    # Best per-call time in milliseconds
+    best = min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1000
+    if key is not None:
+        RESULTS[key] = best
+    return best
+
+
+def make_engine(width=1280, height=720):
+    return Engine(width, height, 'benchmark')
+
+
+def make_world(engine, level_width, floor=200):
+    background = Image.from_surface(pygame.Surface((level_width, engine.height)).convert_alpha())
+    player = characters.Player(Image.from_surface(pygame.Surface((64, 128)).convert_alpha()))
+    world = World(background, player, engine, floor=floor)
+    world.medkit = Image.from_surface(pygame.Surface((32, 32)).convert_alpha())
+    return world
+
+
+@benchmark('render')
+def bench_render():
+    # Frame cost should stay flat as the level gets wider
+    engine = make_engine()
+    for level_width in (2560, 10240, 40960):
+        world = make_world(engine, level_width)
+        world.player.x = level_width / 2
+        world.move_player(0, 0)
+
+        def legacy():
+            abs_pos_surface = world.background_image.surface.copy()
+            world.player.blit_to(abs_pos_surface)
+            engine.surface.blit(abs_pos_surface, (-world.x, world.y))
+
+        print('render width={:<6} viewport {:8.3f} ms   full copy {:8.3f} ms'.format(
+            level_width, measure(world.render, key='render.width{}'.format(level_width)), measure(legacy, number=10)))
+
+
+def populate(world, enemies=0, statics=0):
+    enemy_image = Image.from_surface(pygame.Surface((48, 96)).convert_alpha())
+    spacing = max(world.width // max(enemies, statics, 1), 1)
+    for i in xrange(enemies):
+        world.add_enemy(characters.PatrollingEnemy(enemy_image, x=i * spacing, y=world.floor + 300))
+    for i in xrange(statics):
+        world.add_static(StaticRect(i * spacing, world.floor + 150, 100, 20))
+
+
+@benchmark('entities')
+def bench_entities():
+    # Per-frame cost against entity count, spatial index vs. walking every list
+    engine = make_engine()
+    for count in (10, 100, 1000, 5000):
+        world = make_world(engine, 81920)
+        populate(world, enemies=count, statics=count)
+
+        def linear():
+            for static in world.statics:
+                static.colliding(world.player)
+            for enemy in world.enemies:
+                enemy.move(world.player)
+                enemy.can_see(world.player)
+
+        print('entities={:<5} tick {:8.3f} ms   render {:8.3f} ms   linear tick {:8.3f} ms'.format(
+            count, measure(world.tick, number=20, key='entities.tick.{}'.format(count)),
+            measure(world.render, number=20, key='entities.render.{}'.format(count)), measure(linear, number=20)))
+
+@benchmark('batch')
+def bench_batch():
+    # Enemy simulation per tick, one object at a time vs. NumPy batch
+    from batch import EnemyBatch
+    engine = make_engine()
+    for count in (10, 100, 1000, 10000, 100000):
+        world = make_world(engine, 81920)
+        world.player.y = world.floor + 300
+        populate(world, enemies=count)
+        enemies = world.enemies
+        enemy_batch = EnemyBatch(enemies)
+
+        def objects():
+            for enemy in enemies:
+                enemy.move(world.player)
+                enemy.can_see(world.player)
+
+        number = max(1, 10000 // count)
+        print('enemies={:<6} objects {:9.3f} ms   batch {:8.3f} ms'.format(
+            count, measure(objects, repeat=3, number=number),
+            measure(lambda: enemy_batch.step(world.player), repeat=3, number=number)))
+
+def playable_world(engine):
+    world = make_world(engine, 81920)
+    engine.register_key_handler(K_UP, world.player_jump)
+    engine.register_key_handler(K_LEFT, lambda: world.player_walk(characters.Direction.LEFT))
+    engine.register_key_handler(K_RIGHT, lambda: world.player_walk(characters.Direction.RIGHT))
+    populate(world, enemies=40)
+    return world
+
+
+@benchmark('headless')
+def bench_headless():
+    # Uncapped episodes with a scripted player that walks right, hiding now and then
+    from controls import PolicyInput
+    policy = lambda frame: (K_RIGHT, K_DOWN) if frame % 300 < 5 else (K_RIGHT,)
+    engine = Engine(1280, 720, headless=True, input_source=PolicyInput(policy))
+    world = playable_world(engine)
+    start = timeit.default_timer()
+    result = engine.run(world)
+    elapsed = timeit.default_timer() - start
+    print('headless {} after {} frames, cloak {}: {:.0f} frames/s'.format(
+        result.outcome, result.frames, result.cloak, result.frames / elapsed))
+
+
+@benchmark('runner')
+def bench_runner():
+    # Episode throughput against the number of worker processes
+    import multiprocessing, runner
+    episodes = 32
+    workers = 1
+    while workers <= multiprocessing.cpu_count():
+        start = timeit.default_timer()
+        for _ in runner.run_episodes(xrange(episodes), playable_world, max_frames=2000, workers=workers):
+            pass
+        elapsed = timeit.default_timer() - start
+        print('workers={:<3} {:8.1f} episodes/s'.format(workers, episodes / elapsed))
+        workers *= 2
+
+
+@benchmark('replay')
+def bench_replay():
+    # Record a bot session, save and reload it, then replay it uncapped and seek around in it
+    import tempfile
+    from controls import PolicyInput
+    from replay import InputLog, RecordingInput, Replay
+    policy = lambda frame: (K_RIGHT, K_DOWN) if frame % 300 < 5 else (K_LEFT,) if frame % 400 < 20 else (K_RIGHT,)
+    recorder = RecordingInput(PolicyInput(policy))
+    engine = Engine(1280, 720, headless=True, input_source=recorder)
+    result = engine.run(playable_world(engine), max_frames=6000)
+
+    handle, path = tempfile.mkstemp(suffix='.log')
+    os.close(handle)
+    try:
+        recorder.save(path)
+        log = InputLog.load(path)
+    finally:
+        os.remove(path)
+    assert (log.keys, log.data) == (recorder.log.keys, recorder.log.data), 'saved log differs'
+
+    engine = Engine(1280, 720, headless=True)
+    world = playable_world(engine)
+    replay = Replay(engine, world, log)
+    start = timeit.default_timer()
+    replay.run()
+    elapsed = timeit.default_timer() - start
+    assert (replay.frame, engine.outcome) == (result.frames, result.outcome), 'replay diverged'
+    print('replayed {} frames at {:.0f} frames/s, {} log bytes'.format(
+        replay.frame, replay.frame / elapsed, len(recorder.log.data)))
+    print('seek to middle {:8.3f} ms'.format(measure(lambda: replay.seek(replay.frame // 2), repeat=3, number=5)))
+
+@benchmark('profiler')
+def bench_profiler():
+    # Instrumentation overhead on uncapped headless steps
+    from controls import PolicyInput
+    for enabled in (False, True):
+        engine = Engine(1280, 720, headless=True, input_source=PolicyInput(lambda frame: (K_RIGHT,)))
+        if enabled:
+            engine.profile()
+        world = playable_world(engine)
+        start = timeit.default_timer()
+        result = engine.run(world, max_frames=5000)
+        elapsed = timeit.default_timer() - start
+        print('profiler {:<3} {:8.0f} frames/s'.format('on' if enabled else 'off', result.frames / elapsed))
+        if enabled:
+            stats = engine.profiler.percentiles()
+            print('  step p50 {:.3f} p95 {:.3f} p99 {:.3f} ms'.format(stats[50], stats[95], stats[99]))
+
+@benchmark('dirty')
+def bench_dirty():
+    # Render + present with a still camera, full frames vs. dirty rectangles
+    engine = make_engine()
+    world = make_world(engine, 10240)
+    populate(world, enemies=200)
+
+    def frame(full):
+        world.tick()
+        rects = world.render(full=full)
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+
+    print('still camera  full {:8.3f} ms   dirty rects {:8.3f} ms'.format(
+        measure(lambda: frame(True)), measure(lambda: frame(False))))
+
+@benchmark('text')
+def bench_text():
+    # Narrative text per frame: building a SysFont every frame vs. the text cache
+    engine = make_engine()
+    uncached = lambda: pygame.font.SysFont(None, 200).render('Game Over!', 1, (255, 255, 255))
+    cached = lambda: text_cache.render('Game Over!', 200, (255, 255, 255))
+    print('narrative text  SysFont {:8.3f} ms   cached {:8.3f} ms'.format(
+        measure(uncached, number=20), measure(cached)))
+
+@benchmark('assets')
+def bench_assets():
+    # Start-up sprite loading: plain Image + scale vs. cold and warm asset cache
+    import tempfile, shutil
+    from assets import AssetManager
+    engine = make_engine()
+    sprites = [('resources/sprites/player.png', 0.25), ('resources/sprites/enemy.png', 0.25),
+               ('resources/sprites/enemy_detected.png', 0.25), ('resources/sprites/trophy.png', 0.5),
+               ('resources/sprites/medkit.png', 0.2)]
+
+    def plain():
+        for path, scale in sprites:
+            Image(path).scale(scale)
+
+    def managed(cache_dir):
+        assets = AssetManager(cache_dir)
+        assets.preload(sprites)
+        for path, scale in sprites:
+            assets.load(path, scale)
+        assets.executor.shutdown()
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        start = timeit.default_timer()
+        managed(cache_dir)
+        cold = (timeit.default_timer() - start) * 1000
+        print('sprites  Image+scale {:8.3f} ms   cold cache {:8.3f} ms   warm cache {:8.3f} ms'.format(
+            measure(plain, number=3), cold, measure(lambda: managed(cache_dir), number=3)))
+    finally:
+        shutil.rmtree(cache_dir)
+
+@benchmark('startup')
+def bench_startup():
+    # Wall time from spawning a fresh interpreter to the first menu frame on screen
+    import subprocess
+    script = '; '.join([
+        'from core import *',
+        'engine = Engine(1280, 720)',
+        'menu = Menu()',
+        "menu.init(['Start', 'Quit'], engine.surface)",
+        'menu.draw()',
+        'pygame.display.update()',
+        "sys.stdout.write('ready\\n')",
+        'sys.stdout.flush()',
+    ])
+    samples = []
+    for _ in xrange(5):
+        start = timeit.default_timer()
+        child = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE)
+        while child.stdout.readline().strip() != b'ready':
+            pass
+        samples.append((timeit.default_timer() - start) * 1000)
+        child.wait()
+    print('process start to first menu frame {:8.1f} ms (best of 5)'.format(min(samples)))
+
+@benchmark('tiles')
+def bench_tiles():
+    # Scroll across a tiled level and report how many tiles stay decoded
+    import tempfile, shutil
+    engine = make_engine()
+    directory = tempfile.mkdtemp()
+    try:
+        level = pygame.Surface((40960, engine.height))
+        pygame.image.save(level, os.path.join(directory, 'level.png'))
+        background = TiledImage(TiledImage.split(os.path.join(directory, 'level.png'), directory, 1024))
+        world = make_world(engine, 2560)
+        world.background_image = background
+        world.width = background.width
+        peak = 0
+        for x in xrange(0, background.width - engine.width, 15):
+            world.x = x
+            world.render()
+            peak = max(peak, sum(tile.get_width() * tile.get_height() * 4 for tile in background._tiles.values()))
+        print('tiled width={} peak decoded {:.1f} MB, monolithic {:.1f} MB'.format(
+            background.width, peak / 1e6, background.width * background.height * 4 / 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+@benchmark('pool')
+def bench_pool():
+    # Bytes per entity with and without __slots__, and medkit spawn/despawn churn
+    class DictPickup(object):
+        def __init__(self, x, y, width, height):
+            self.x = x
+            self.y = y
+            self.width = width
+            self.height = height
+
+    slotted = Pickup(0, 0, 32, 32)
+    plain = DictPickup(0, 0, 32, 32)
+    print('pickup size     slots {:5d} B   dict {:5d} B'.format(
+        sys.getsizeof(slotted), sys.getsizeof(plain) + sys.getsizeof(plain.__dict__)))
+
+    image = Image.from_surface(pygame.Surface((48, 96)))
+    enemy = characters.PatrollingEnemy(image)
+    print('enemy size      slots {:5d} B'.format(sys.getsizeof(enemy)))
+
+    engine = make_engine()
+    for count in (100, 1000, 10000):
+        world = make_world(engine, 81920)
+        for i in xrange(count):
+            world.add_medkit((i * 8, world.floor))
+        pickups = list(world.medkits)
+        rng = random.Random(count)
+
+        def churn():
+            # Pick up every medkit in a shuffled order, then lay them out again
+            rng.shuffle(pickups)
+            for pickup in pickups:
+                world.remove_medkit(pickup)
+            del pickups[:]
+            for i in xrange(count):
+                pickups.append(world.add_medkit((i * 8, world.floor)))
+
+        print('medkits={:<6} remove + respawn all {:8.3f} ms'.format(count, measure(churn, repeat=3, number=3)))
+
+def write_level(path, chunks, enemies_per_chunk, background, chunk_width=2048):
+    # A long synthetic level with enemies, platforms and medkits in every chunk
+    import json
+    sprites = {'player': ['resources/sprites/player.png', 0.25], 'enemy': ['resources/sprites/enemy.png', 0.25],
+               'medkit': ['resources/sprites/medkit.png', 0.2]}
+    spacing = chunk_width // enemies_per_chunk
+    with open(path, 'w') as level_file:
+        level_file.write(json.dumps({'format': 'incognito-level', 'version': 1, 'chunk_width': chunk_width,
+                                     'floor': 200, 'tiles': background, 'sprites': sprites}) + '\n')
+        for chunk in xrange(chunks):
+            left = chunk * chunk_width
+            level_file.write(json.dumps({
+                'chunk': chunk,
+                'enemies': [{'x': left + i * spacing, 'y': 500} for i in xrange(enemies_per_chunk)],
+                'statics': [{'x': left + 300, 'y': 350, 'width': 100, 'height': 20}],
+                'medkits': [[left + 1000, 200]],
+            }) + '\n')
+
+
+@benchmark('level')
+def bench_level():
+    # Load time and tick cost of a streamed level against everything loaded and awake
+    import tempfile, shutil
+    from level import Level
+    engine = make_engine()
+    directory = tempfile.mkdtemp()
+    try:
+        for chunks in (10, 100, 400):
+            tiles = os.path.join(directory, 'tiles{}'.format(chunks))
+            os.mkdir(tiles)
+            pygame.image.save(pygame.Surface((chunks * 2048, 16)), os.path.join(tiles, 'level.png'))
+            TiledImage.split(os.path.join(tiles, 'level.png'), tiles, 2048)
+            os.remove(os.path.join(tiles, 'level.png'))
+            path = os.path.join(directory, 'level{}.jsonl'.format(chunks))
+            write_level(path, chunks, 25, tiles)
+
+            start = timeit.default_timer()
+            streamed = Level(path, engine).build_world()
+            load = (timeit.default_timer() - start) * 1000
+
+            everything = Level(path, engine, active_margin=chunks * 2048).build_world()
+            print('chunks={:<4} enemies={:<6} load {:8.1f} ms   tick streamed {:7.3f} ms   all awake {:8.3f} ms'.format(
+                chunks, len(everything.level.enemies), load,
+                measure(streamed.tick, number=20), measure(everything.tick, number=5)))
+    finally:
+        shutil.rmtree(directory)
+
+@benchmark('collision')
+def bench_collision():
+    # Player collision queries per second: swept AABB through the grid vs. StaticRect.colliding
+    import collision
+    from spatial import SpatialGrid
+    rng = random.Random(0)
+    player = characters.Player(Image.from_surface(pygame.Surface((64, 128))))
+    for count in (100, 1000, 10000):
+        statics = [StaticRect(rng.randint(0, 81920), rng.randint(200, 700), rng.randint(20, 300), rng.randint(4, 40))
+                   for _ in xrange(count)]
+        index = SpatialGrid()
+        for static in statics:
+            index.insert(static, static.x, static.y, static.width, static.height)
+        moves = [(rng.randint(0, 81920), rng.randint(200, 600), rng.randint(-15, 15), rng.randint(-30, 30))
+                 for _ in xrange(1000)]
+
+        def swept():
+            for x, y, dx, dy in moves:
+                player.x, player.y = x, y
+                collision.move(player, dx, dy, index)
+
+        def grid_colliding():
+            for x, y, dx, dy in moves:
+                player.x, player.y = x + dx, y + dy
+                for static in index.query(player.x - 128, player.y - 128, player.width + 256, player.height + 256):
+                    static.colliding(player)
+
+        def linear_colliding():
+            for x, y, dx, dy in moves[:100]:
+                player.x, player.y = x + dx, y + dy
+                for static in statics:
+                    static.colliding(player)
+
+        print('statics={:<6} swept {:9.0f}/s   grid + colliding {:9.0f}/s   colliding all {:9.0f}/s'.format(
+            count, 1000 / measure(swept, repeat=3, number=3) * 1000,
+            1000 / measure(grid_colliding, repeat=3, number=3) * 1000,
+            100 / measure(linear_colliding, repeat=3, number=1) * 1000))
+
+@benchmark('input')
+def bench_input():
+    # Per-frame key dispatch against the number of bound keys, and key press to screen latency
+    from controls import HELD
+    engine = make_engine()
+    for count in (4, 64, 256):
+        engine.key_handlers[HELD] = {}
+        engine.watched_keys = set()
+        for key in xrange(count):
+            engine.register_key_handler(key, lambda: None)
+
+        def legacy():
+            # What poll() did before: ask for every bound key each frame
+            pygame.event.get()
+            keys_down = pygame.key.get_pressed()
+            for key in engine.key_handlers[HELD].keys():
+                if key < len(keys_down) and keys_down[key]:
+                    for handler in engine.key_handlers[HELD][key]:
+                        handler()
+
+        print('keys={:<4} dispatch {:8.4f} ms   poll every key {:8.4f} ms'.format(
+            count, measure(engine.poll, number=1000), measure(legacy, number=1000)))
+
+    world = playable_world(engine)
+    engine.profile()
+    for frame in xrange(600):
+        if frame % 20 == 0:
+            pygame.event.post(pygame.event.Event(KEYDOWN, key=K_UP, mod=0))
+        elif frame % 20 == 5:
+            pygame.event.post(pygame.event.Event(KEYUP, key=K_UP, mod=0))
+        engine.profiler.begin()
+        engine.step(world)
+        engine.present(world.render())
+    stats = engine.profiler.percentiles('latency')
+    print('press to screen p50 {:.2f} ms   p95 {:.2f} ms over {} presses'.format(
+        stats[50], stats[95], len(engine.profiler.latencies)))
+
+@benchmark('hotpaths')
+def bench_hotpaths():
+    # Small, stable cases for each per-frame path, meant for --baseline runs
+    engine = make_engine()
+    for count in (10, 100, 1000):
+        world = make_world(engine, 81920)
+        populate(world, enemies=count, statics=count)
+        print('World.tick        enemies+statics={:<5} {:8.4f} ms'.format(
+            count, measure(world.tick, number=max(20, 2000 // count), key='tick.{}'.format(count))))
+
+    world = make_world(engine, 10240)
+    populate(world, enemies=20, statics=20)
+    print('World.render      {:8.4f} ms'.format(measure(world.render, number=50, key='render')))
+
+    def camera():
+        # Run the player into both ends of the level so every clamp is hit
+        world.move_player(-world.width, 0)
+        world.move_player(world.width, 0)
+        world.move_player(-300, 0)
+    print('World.move_player {:8.4f} ms'.format(measure(camera, number=1000, key='move_player')))
+
+    enemy = world.enemies[0]
+    player = world.player
+    player.x, player.y, player.visible = enemy.x - 100, enemy.y, True
+    print('Enemy.can_see     {:8.4f} ms'.format(measure(lambda: enemy.can_see(player), number=10000, key='can_see')))
+
+    static = StaticRect(player.x + 10, player.y - 10, 100, 20)
+    print('StaticRect.colliding {:8.4f} ms'.format(
+        measure(lambda: static.colliding(player), number=10000, key='colliding')))
+
+    def load_sprite():
+        Image('resources/sprites/enemy.png').scale(0.25)
+    print('Image load+scale  {:8.4f} ms'.format(measure(load_sprite, number=10, key='image_load_scale')))
+
+    def build_menu():
+        menu = Menu()
+        menu.init(['Start', 'Quit'], engine.surface)
+        return menu
+    menu = build_menu()
+    print('Menu.create_struct {:8.4f} ms'.format(measure(build_menu, number=100, key='menu.create_struct')))
+    print('Menu.draw         {:8.4f} ms'.format(measure(lambda: menu.draw(1), number=100, key='menu.draw')))
+
+@benchmark('threaded')
+def bench_threaded():
+    # Simulation rate while every present stalls for 120 ms, with and without the render thread
+    for threaded in (False, True):
+        engine = Engine(1280, 720, 'benchmark', render_thread=threaded)
+        world = playable_world(engine)
+        flip = engine.flip
+        steps = [0]
+
+        def slow_flip(rects=None, profiler=None):
+            time.sleep(0.12)
+            flip(rects, profiler)
+
+        def counted_step(world, step=engine.step):
+            step(world)
+            steps[0] += 1
+            if steps[0] >= 180:
+                engine.stop()
+
+        engine.flip = slow_flip
+        engine.step = counted_step
+        start = timeit.default_timer()
+        engine.start(world)
+        elapsed = timeit.default_timer() - start
+        print('render thread {:<3} {:6.1f} steps/s'.format('on' if threaded else 'off', steps[0] / elapsed))
+
+@benchmark('cloak')
+def bench_cloak():
+    # Drawing the hidden player: refill a colorkeyed scratch surface each frame vs. a pre-faded sprite
+    engine = make_engine()
+    image = Image('resources/sprites/player.png')
+    image.scale(0.25)
+    player = characters.Player(image)
+    player.visible = False
+    scratch = pygame.Surface((player.width, player.height))
+    scratch.set_colorkey((0, 0, 0))
+
+    def refill():
+        scratch.fill((0, 0, 0))
+        scratch.blit(image.get_surface(), (0, 0))
+        scratch.set_alpha(player.cloaked_alpha)
+        engine.surface.blit(scratch, (100, 100))
+
+    print('cloaked player  refill + colorkey {:8.4f} ms   faded variant {:8.4f} ms'.format(
+        measure(refill, number=1000), measure(lambda: player.blit_to(engine.surface), number=1000, key='cloak.blit')))
+
+@benchmark('agents')
+def bench_agents():
+    # Agent steps per second for many bots sharing one level vs. one World per bot
+    import numpy
+    from batch import AgentBatch
+    from controls import PolicyInput
+    policy = lambda frame: (K_RIGHT, K_DOWN) if frame % 300 < 5 else (K_RIGHT,)
+    engine = Engine(1280, 720, headless=True, input_source=PolicyInput(policy))
+    world = playable_world(engine)
+    print('one World          {:10.0f} agent steps/s'.format(1000 / measure(lambda: engine.step(world), repeat=3, number=200)))
+
+    for count in (100, 1000, 10000):
+        agents = AgentBatch(playable_world(make_engine()), count)
+        walk = numpy.ones(count, dtype=numpy.int64)
+        jump = numpy.zeros(count, dtype=bool)
+        hide = numpy.arange(count) % 50 == 0
+        elapsed = measure(lambda: agents.step(walk, jump, hide), repeat=3, number=20)
+        print('agents={:<6}      {:10.0f} agent steps/s'.format(count, count * 1000 / elapsed))
+
+
+@benchmark('snapshot')
+def bench_snapshot():
+    # Packing and restoring the whole world against entity count, with the
+    # pickled tuples of the same values for comparison
+    import cPickle
+    engine = make_engine()
+    for count in (100, 1000, 10000):
+        world = make_world(engine, 81920)
+        populate(world, enemies=count)
+        for i in xrange(count):
+            world.add_medkit((i * 8, world.floor))
+        # Restores alternate between two states, one step apart like a rewind
+        # by a frame, or a second apart so that every enemy changes grid cells
+        start = world.snapshot()
+        world.tick()
+        step = [start, world.snapshot()]
+        for _ in xrange(59):
+            world.tick()
+        second = [start, world.snapshot()]
+
+        def pickled():
+            return cPickle.dumps(([(enemy.x, enemy.prev_x, enemy.facing, enemy.image is enemy.detected_image) for enemy in world.enemies],
+                                  [(pickup.x, pickup.y) for pickup in world.medkits]), cPickle.HIGHEST_PROTOCOL)
+
+        print('entities={:<6} snapshot {:8.3f} ms   restore step {:8.3f} ms  second {:8.3f} ms   {:7d} B   pickled {:8.3f} ms {:7d} B'.format(
+            count, measure(world.snapshot, repeat=3, number=20, key='snapshot.take{}'.format(count)),
+            measure(lambda: world.restore(step.reverse() or step[0]), repeat=3, number=20, key='snapshot.restore_step{}'.format(count)),
+            measure(lambda: world.restore(second.reverse() or second[0]), repeat=3, number=20, key='snapshot.restore{}'.format(count)),
+            len(start), measure(pickled, repeat=3, number=20), len(pickled())))
+
+
+@benchmark('pacing')
+def bench_pacing():
+    # Frame cost at each frame pacer quality level, hiding among lots of enemies
+    from pacing import LEVELS
+    engine = make_engine()
+    pacer = engine.pace()
+    world = make_world(engine, 81920)
+    populate(world, enemies=2000)
+    world.player.visible = False
+    frame_count = [0]
+
+    def frame():
+        # The cloak drains while hiding, so the HUD changes every frame
+        frame_count[0] += 1
+        engine.draw_frame(world, world.capture()._replace(cloak=100 - frame_count[0] % 50))
+
+    for level, name in enumerate(LEVELS):
+        pacer.pin(level)
+        print('{:<24} {:8.3f} ms'.format(name, measure(frame, key='pacing.level{}'.format(level))))
+
+
+def compare(baseline, tolerance):
+    # Timings more than tolerance slower than the baseline count as regressions
+    regressions = []
+    for key, value in RESULTS.items():
+        if key not in baseline:
+            continue
+        ratio = value / baseline[key] if baseline[key] else 1.0
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print('{:<28} {:9.4f} ms  baseline {:9.4f} ms  {:6.2f}x{}'.format(key, value, baseline[key], ratio, flag))
+    return regressions
+
+
+def main(args):
+    # python benchmark.py [name ...] [--json results.json] [--baseline baseline.json] [--tolerance 0.25]
+    # Without a baseline file, --baseline writes one from this run.
+    options = {}
+    for option in ('--json', '--baseline', '--tolerance'):
+        if option in args:
+            index = args.index(option)
+            options[option] = args[index + 1]
+            del args[index:index + 2]
+
+    for name in args or BENCHMARKS.keys():
+        print('== {}'.format(name))
+        BENCHMARKS[name]()
+
+    if '--json' in options:
+        with open(options['--json'], 'w') as results_file:
+            json.dump(RESULTS, results_file, indent=2, separators=(',', ': '))
+
+    baseline_path = options.get('--baseline')
+    if baseline_path and not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(RESULTS, baseline_file, indent=2, separators=(',', ': '))
+        print('Saved {} timings as the baseline in {}'.format(len(RESULTS), baseline_path))
+    elif baseline_path:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        print('== compared with {}'.format(baseline_path))
+        regressions = compare(baseline, float(options.get('--tolerance', 0.25)))
+        if regressions:
+            print('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,10 +5,18 @@ class Direction(object):
     RIGHT = 1
 
 class Character(object):
+    # Slots keep per-entity memory down on levels with lots of characters
+    __slots__ = ('image', 'x', 'y', 'prev_x', 'prev_y', 'speed', 'facing', 'jumping', 'dy', 'width', 'height')
+
+    # Direction the unflipped sprite is drawn facing
+    sprite_facing = Direction.LEFT
+
     def __init__(self, image, x=0, y=0, speed=7):
         self.image = image
         self.x = x
         self.y = y
+        self.prev_x = x
+        self.prev_y = y
         self.speed = speed
         self.facing = Direction.LEFT
         self.jumping = False
@@ -17,27 +25,34 @@ class Character(object):
         self.width = self.image.width
         self.height = self.image.height
     
-    def blit_to(self, surface):
-        surface.blit(self.image.surface, (self.x, surface.get_height() - self.y - self.height))
+    def current_surface(self):
+        # The sprite as it should be drawn right now
+        return self.image.get_surface(self.facing != self.sprite_facing)
+
+    def blit_to(self, surface, offset=(0, 0)):
+        return surface.blit(self.current_surface(), (self.x - offset[0], surface.get_height() - self.y - self.height + offset[1]))
 
 
 class Player(Character):
+    __slots__ = ('visible', 'cloak')
+
+    sprite_facing = Direction.RIGHT
+    # Opacity while hiding
+    cloaked_alpha = 50
+
     def __init__(self, image, x=0, y=0):
         Character.__init__(self, image, x, y, speed=15)
         self.facing = Direction.RIGHT
         self.visible = True
-        self.transparent_surface = pygame.Surface((self.width, self.height))
-        self.transparent_surface.set_colorkey((0,0,0))
         self.cloak = 100.0
 
-    def blit_to(self, surface):
-        self.transparent_surface.fill((0,0,0))
-        self.transparent_surface.blit(self.image.surface, (0,0))
-        self.transparent_surface.set_alpha(50 if not self.visible else 255)
-        surface.blit(self.transparent_surface, (self.x, surface.get_height() - self.y - self.height))
+    def current_surface(self):
+        return self.image.get_surface(self.facing != self.sprite_facing, 255 if self.visible else self.cloaked_alpha)
 
 
 class Enemy(Character):
+    __slots__ = ('view_distance', 'detected_image', 'normal_image', '_pool_index')
+
     def __init__(self, image, x=0, y=0, speed=7, view_distance=200, detected_image=None):
         Character.__init__(self, image, x, y, speed)
         self.view_distance = view_distance
@@ -67,13 +82,13 @@ class Enemy(Character):
             self.image = self.normal_image
         return False
 
-    def blit_vision_to(self, surface):
-        pygame.draw.rect(
+    def blit_vision_to(self, surface, offset=(0, 0)):
+        return pygame.draw.rect(
             surface,
             (255, 0, 0), # Color
             [
-                self.x+self.width*(self.facing==Direction.RIGHT), # x-coord
-                surface.get_height() - self.y, # y-coord
+                self.x+self.width*(self.facing==Direction.RIGHT) - offset[0], # x-coord
+                surface.get_height() - self.y + offset[1], # y-coord
                 self.view_distance*self.facing, # width
                 -1*self.height # height
             ],
@@ -84,6 +99,8 @@ class Enemy(Character):
 
 
 class PatrollingEnemy(Enemy):
+    __slots__ = ('patrol_area_left', 'patrol_area_right', 'walls')
+
     def __init__(self, image, x=0, y=0, speed=7, view_distance=300, patrol_distance=300, detected_image=None):
         Enemy.__init__(self, image, x, y, speed, view_distance, detected_image)
         self.patrol_area_left = x
@@ -91,6 +108,5 @@ class PatrollingEnemy(Enemy):
 
     def move(self, player):
         if self.x < self.patrol_area_left or self.x > self.patrol_area_right + self.width:
-            self.image.surface = pygame.transform.flip(self.image.surface, True, False)
             self.facing *= -1
         self.x += self.facing * self.speed
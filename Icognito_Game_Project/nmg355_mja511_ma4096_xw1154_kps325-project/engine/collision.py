@@ -0,0 +1,86 @@
+INFINITY = float('inf')
+
+# Axis-aligned boxes are anything with x, y, width and height, y pointing up
+# like the rest of the world. Movers are swept against the boxes a
+# SpatialGrid returns for the area they pass through, so a fast mover cannot
+# skip over a thin platform between two ticks.
+
+def _axis_times(position, size, delta, box_position, box_size):
+    # Fractions of the move at which the mover starts and stops overlapping the box on one axis
+    if delta > 0:
+        return (box_position - (position + size)) / float(delta), (box_position + box_size - position) / float(delta)
+    if delta < 0:
+        return (box_position + box_size - position) / float(delta), (box_position - (position + size)) / float(delta)
+    if position < box_position + box_size and position + size > box_position:
+        return -INFINITY, INFINITY
+    return INFINITY, -INFINITY
+
+
+def sweep(mover, dx, dy, box):
+    # Returns (time, normal_x, normal_y) for the first contact of the move with box, or None
+    x_entry, x_exit = _axis_times(mover.x, mover.width, dx, box.x, box.width)
+    y_entry, y_exit = _axis_times(mover.y, mover.height, dy, box.y, box.height)
+    entry = max(x_entry, y_entry)
+    leave = min(x_exit, y_exit)
+    if entry >= leave or entry > 1 or leave <= 0:
+        return None
+
+    if entry < 0:
+        # Already inside, push out along the shallowest axis
+        depth, normal_x, normal_y = min(
+            (box.y + box.height - mover.y, 0, 1),
+            (mover.y + mover.height - box.y, 0, -1),
+            (box.x + box.width - mover.x, 1, 0),
+            (mover.x + mover.width - box.x, -1, 0),
+        )
+        return 0.0, normal_x, normal_y
+
+    if x_entry > y_entry:
+        return entry, (-1 if dx > 0 else 1), 0
+    return entry, 0, (-1 if dy > 0 else 1)
+
+
+def first_hit(mover, dx, dy, index):
+    # Broad phase: only boxes in the grid cells the move passes through
+    left = min(mover.x, mover.x + dx)
+    bottom = min(mover.y, mover.y + dy)
+    right = left + mover.width + abs(dx)
+    top = bottom + mover.height + abs(dy)
+    best = None
+    for box in index.query(left, bottom, right - left, top - bottom, ordered=False):
+        # Grid cells are coarse, so skip boxes the swept area misses entirely
+        if box.x > right or box.x + box.width < left or box.y > top or box.y + box.height < bottom:
+            continue
+        hit = sweep(mover, dx, dy, box)
+        # Ties go to the leftmost, then lowest box so the result does not depend on set order
+        if hit is not None:
+            hit = (hit[0], box.x, box.y, hit[1], hit[2], box)
+            if best is None or hit < best:
+                best = hit
+    if best is not None:
+        return best[0], best[3], best[4], best[5]
+
+
+def move(mover, dx, dy, index):
+    # Moves mover by (dx, dy), stopping flush against the first box it hits on
+    # an axis and sliding along the other. Returns every (box, normal_x,
+    # normal_y) contact made.
+    contacts = []
+    # A few passes at most, in case pushing out of one box lands in another
+    for _ in xrange(4):
+        if not dx and not dy:
+            break
+        hit = first_hit(mover, dx, dy, index)
+        if hit is None:
+            break
+        time, normal_x, normal_y, box = hit
+        contacts.append((box, normal_x, normal_y))
+        if normal_x:
+            mover.x = box.x - mover.width if normal_x < 0 else box.x + box.width
+            dx = 0
+        else:
+            mover.y = box.y - mover.height if normal_y < 0 else box.y + box.height
+            dy = 0
+    mover.x += dx
+    mover.y += dy
+    return contacts
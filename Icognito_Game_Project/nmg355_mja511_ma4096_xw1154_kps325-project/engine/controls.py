@@ -0,0 +1,64 @@
+from pygame.locals import KEYDOWN, KEYUP, ACTIVEEVENT
+from timeit import default_timer as timer
+
+# Input sources hand the engine the set of watched keys that are held down on
+# the current frame, so the simulation never has to ask the keyboard itself.
+
+# When a key handler runs: on the frame the key goes down, on the frame it
+# comes back up, or on every frame it is held
+PRESS = 'press'
+RELEASE = 'release'
+HELD = 'held'
+
+
+class KeyboardInput(object):
+    # Key state kept up to date from the pygame events the engine hands to
+    # handle(), so a frame only costs as much as the keys actually down. A key
+    # tapped and released between two polls still counts as held for a frame.
+    def __init__(self):
+        self.down = set()
+        self.tapped = set()
+        # When the oldest press not yet on screen arrived, for latency figures
+        self.pressed_at = None
+
+    def handle(self, event):
+        if event.type == KEYDOWN:
+            if event.key not in self.down:
+                self.down.add(event.key)
+                self.tapped.add(event.key)
+                if self.pressed_at is None:
+                    self.pressed_at = timer()
+        elif event.type == KEYUP:
+            self.down.discard(event.key)
+        elif event.type == ACTIVEEVENT and not event.gain and event.state & 2:
+            # Lost input focus, so we will never see these keys come up
+            self.down.clear()
+
+    def poll(self, keys):
+        held = frozenset(key for key in self.down.union(self.tapped) if key in keys)
+        self.tapped.clear()
+        return held
+
+
+class ScriptedInput(object):
+    # Plays back a list with one collection of held keys per frame
+    def __init__(self, frames):
+        self.frames = frames
+        self.frame = 0
+
+    def poll(self, keys):
+        held = self.frames[self.frame] if self.frame < len(self.frames) else ()
+        self.frame += 1
+        return frozenset(key for key in held if key in keys)
+
+
+class PolicyInput(object):
+    # Asks policy(frame) which keys to hold, e.g. for bots
+    def __init__(self, policy):
+        self.policy = policy
+        self.frame = 0
+
+    def poll(self, keys):
+        held = self.policy(self.frame)
+        self.frame += 1
+        return frozenset(key for key in held if key in keys)
@@ -1,41 +1,150 @@
-try:
-    import cairosvg
-    SVG_ENABLED = True
-except:
-    SVG_ENABLED = False
-
-import pygame, sys, logging, collections, time
+import pygame, os, sys, struct, logging, collections, time
 from pygame.locals import *
-from StringIO import StringIO
-from Queue import Queue
+from timeit import default_timer as timer
+from spatial import SpatialGrid
+from controls import KeyboardInput, PRESS, RELEASE, HELD
+from pool import EntityPool
+import collision
+from characters import PatrollingEnemy, Direction
+
+EpisodeResult = collections.namedtuple('EpisodeResult', ['outcome', 'frames', 'cloak', 'detected_at'])
+
+# One frame as captured by World.capture. ops are screen-space draw calls,
+# (BLIT, surface, position) or (RECT, color, rect, line width).
+# narrative is set instead when the engine is showing a message.
+RenderFrame = collections.namedtuple('RenderFrame', ['camera_x', 'facing', 'ops', 'cloak', 'narrative'])
+BLIT = 0
+RECT = 1
+
+# World.snapshot packs the simulation state into a string, all little-endian:
+#   header | enemy x (n doubles) | enemy prev_x (n doubles) | enemy flags (n bytes) | medkit x, y (2m doubles)
+# The header holds the camera, detection point, player, level streaming
+# state and the counts n and m. Enemy flags are 1 when facing right and 2
+# when showing the detected sprite.
+SNAPSHOT_MAGIC = b'INCW'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sB' 'dd' '?dd' 'ddddd??db' '?iii' 'II')
 
 class Engine(object):
-    def __init__(self, width, height, title=''):
+    WIN = 'win'
+    LOSE = 'lose'
+
+    def __init__(self, width, height, title='', sim_rate=60, fps=60, interpolate=False, max_frame_skip=5, time_scale=1.0,
+                 headless=False, input_source=None, dirty_rects=False, icon=None, render_thread=False):
         self.width = width
         self.height = height
         self.title = title
-        self.key_handlers = collections.defaultdict(list)
-        self.events = Queue()
+
+        # The world is stepped at a fixed sim_rate no matter how fast frames
+        # are drawn. time_scale > 1 runs the simulation faster than real time.
+        self.sim_rate = sim_rate
+        self.fps = fps
+        self.interpolate = interpolate
+        self.max_frame_skip = max_frame_skip
+        self.time_scale = time_scale
+
+        # Only push the parts of the window that changed while the camera is still
+        self.dirty_rects = dirty_rects
+        # Draw and present on a separate thread so the simulation never waits on the display
+        self.render_thread = render_thread
+        self.renderer = None
+
+        # Headless engines never open a window and are driven through run()
+        self.headless = headless
+        self.keyboard = KeyboardInput()
+        self.input = input_source or self.keyboard
+        self.watched_keys = set()
+        self.keys_down = frozenset()
+
+        self.key_handlers = {PRESS: {}, RELEASE: {}, HELD: {}}
         self.started = False
         self.narrate = False
         self.narrate_text = ""
+        self.outcome = None
+        self.profiler = None
+        self.pacer = None
+        # The cloak meter, composed into one surface when it needs redrawing
+        self.hud = None
+        self.hud_cloak = None
         # self.menu = Menu()
 
-        pygame.init()
+        # Only the subsystems the game uses; audio and joysticks stay off
+        self.init_display()
+        pygame.font.init()
+        # Setting an icon first stops set_mode from importing pkg_resources
+        # to find pygame's default one, which is most of our start-up time
+        pygame.display.set_icon(pygame.image.load(icon) if icon else pygame.Surface((32, 32), SRCALPHA))
         self.surface = pygame.display.set_mode((self.width, self.height))
         pygame.display.set_caption(self.title)
 
         self.clock = pygame.time.Clock()
 
+        from assets import AssetManager
+        self.assets = AssetManager()
+
+        # Load the HUD and narrative fonts up front instead of mid-game
+        text_cache.font(None, 36)
+        text_cache.font(None, 200)
+
         logging.debug('Initialized {}x{} engine'.format(self.width, self.height))
 
-    def register_key_handler(self, key, handler):
-        if key in self.key_handlers:
-            self.key_handlers[key].append(handler)
+    def init_display(self):
+        # Headless engines use SDL's dummy video driver. The variable is only
+        # set while the display starts, so later engines still get a window.
+        # pygame has one display per process: switching between headless and
+        # windowed restarts it, and the surface of any engine created before
+        # the switch is no longer usable.
+        requested = os.environ.get('SDL_VIDEODRIVER')
+        wanted_dummy = self.headless or requested == 'dummy'
+        if pygame.display.get_init() and (pygame.display.get_driver() == 'dummy') != wanted_dummy:
+            pygame.display.quit()
+        if self.headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        try:
+            pygame.display.init()
+        finally:
+            if self.headless:
+                if requested is None:
+                    del os.environ['SDL_VIDEODRIVER']
+                else:
+                    os.environ['SDL_VIDEODRIVER'] = requested
+
+    def watch_key(self, key):
+        self.watched_keys.add(key)
+
+    def key_down(self, key):
+        return key in self.keys_down
+
+    def register_key_handler(self, key, handler, when=HELD):
+        self.watch_key(key)
+        handlers = self.key_handlers[when]
+        if key in handlers:
+            handlers[key].append(handler)
         else:
-            self.key_handlers[key] = [handler]
+            handlers[key] = [handler]
+
+    def pump_events(self, block=False):
+        # The only place the pygame event queue is read. Keeps the keyboard
+        # state current and returns every key press, key repeats included,
+        # for things like the menu. block=True sleeps until there is an event.
+        events = pygame.event.get()
+        if block and not events:
+            events = [pygame.event.wait()] + pygame.event.get()
+        presses = []
+        for event in events:
+            if event.type == QUIT:
+                self.quit()
+            elif event.type in (KEYDOWN, KEYUP, ACTIVEEVENT):
+                self.keyboard.handle(event)
+                if event.type == KEYDOWN:
+                    presses.append(event.key)
+        return presses
 
     def init(self, world):
+        # world may also be a function that builds it. It is then only called
+        # once Start is picked, so the level can keep loading behind the menu.
+        # Level sprites decode in the background while the menu is up
+        self.assets.preload([('resources/sprites/trophy.png', 0.5), ('resources/sprites/medkit.png', 0.2)])
         self.surface.fill((51,51,51))
         menu = Menu()
         menu.init(['Start','Quit'], self.surface)
@@ -44,86 +153,265 @@ class Engine(object):
         pygame.display.update()
         start = False
         while not start:
-            for event in pygame.event.get():
-                if event.type == KEYDOWN:
-                    if event.key == K_UP:
-                        menu.draw(-1)
-                    if event.key == K_DOWN:
-                        menu.draw(1)
-                    if event.key == K_RETURN:
-                        if menu.get_position() == 0:
-                            start = True
-                        elif menu.get_position() == 1:
-                            self.quit()
-                    if event.key == K_ESCAPE:
-                        pygame.display.quit()
-                        sys.exit()
-                    pygame.display.update()
-                elif event.type == QUIT:
+            for key in self.pump_events(block=True):
+                if key == K_UP:
+                    menu.draw(-1)
+                if key == K_DOWN:
+                    menu.draw(1)
+                if key == K_RETURN:
+                    if menu.get_position() == 0:
+                        start = True
+                    elif menu.get_position() == 1:
+                        self.quit()
+                if key == K_ESCAPE:
                     pygame.display.quit()
                     sys.exit()
-            pygame.time.wait(8)
+                pygame.display.update()
+        # Keys tapped on the menu were never polled, so they would all count
+        # as held on the first step, and the latency clock would include the menu
+        self.keyboard.tapped.clear()
+        self.keyboard.pressed_at = None
+        self.keys_down = frozenset()
+        if callable(world):
+            world = world()
         self.start(world)
 
 
-    def tick(self):
-        for event in pygame.event.get():
-            if event.type == QUIT:
-                self.quit()
-
-        keys_down = pygame.key.get_pressed()
-        for key in self.key_handlers.keys():
-            if key < len(keys_down) and keys_down[key]: # WTF is K_LAST and why is it screwing this up???
-                for handler in self.key_handlers[key]:
-                    handler()
+    def profile(self, path=None, overlay=False, size=600):
+        # Opt in to per-phase frame timings, dumped to path (.csv/.json) on quit
+        from profiler import FrameProfiler
+        self.profiler = FrameProfiler(size, path, overlay)
+
+    def pace(self, **options):
+        # Opt in to dropping optional drawing when frames run over budget (see pacing.py)
+        from pacing import FramePacer
+        self.pacer = FramePacer(self.fps, **options)
+        return self.pacer
+
+    def poll(self):
+        if not self.headless:
+            self.pump_events()
+        if self.profiler:
+            self.profiler.mark('events')
+
+        # Only keys that are down or just changed are looked at
+        held = self.input.poll(self.watched_keys)
+        pressed = held - self.keys_down
+        released = self.keys_down - held
+        self.keys_down = held
+        for when, keys in ((PRESS, pressed), (HELD, held), (RELEASE, released)):
+            handlers = self.key_handlers[when]
+            for key in keys:
+                if key in handlers:
+                    for handler in handlers[key]:
+                        handler()
+        if self.profiler:
+            self.profiler.mark('handlers')
+
+    def present(self, rects=None):
+        self.flip(rects, self.profiler)
+        if self.profiler:
+            self.profiler.end()
+
+    def flip(self, rects=None, profiler=None):
+        # Pass the frame's profiler to time the frame cap apart from presenting
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+        if self.profiler and self.keyboard.pressed_at is not None:
+            # A key press has now made it through a step and onto the screen
+            self.profiler.latency((timer() - self.keyboard.pressed_at) * 1000)
+        self.keyboard.pressed_at = None
+        if self.pacer:
+            self.pacer.end()
+        if profiler:
+            profiler.mark('present')
+        self.clock.tick(self.fps)
+        if profiler:
+            profiler.mark('wait')
 
-        pygame.display.update()
-        self.clock.tick(60)
+    def tick(self):
+        self.poll()
+        self.present()
+
+    def step(self, world):
+        world.begin_step()
+        self.poll()
+        world.tick()
+        if self.profiler:
+            self.profiler.mark('tick')
+
+        if world.player.x + world.player.width > world.width - 50:
+            self.win()
+        if world.player.cloak <= 0:
+            self.lose()
+
+    def run(self, world, max_frames=100000):
+        # Simulate a whole episode as fast as possible: no menu, no drawing
+        # and no frame cap. Input comes from self.input.
+        self.populate(world)
+        self.narrate = False
+        self.outcome = None
+        self.keys_down = frozenset()
+        frames = 0
+        profiler = self.profiler
+        while self.outcome is None and frames < max_frames:
+            if profiler:
+                profiler.begin()
+            self.step(world)
+            if profiler:
+                profiler.end()
+            frames += 1
+        return EpisodeResult(self.outcome, frames, world.player.cloak, world.detected_at)
 
-    def start(self, world):
-        self.started = True
+    def populate(self, world):
+        if world.goal is not None:
+            return
 
-        pygame.draw.rect(world.background_image.surface, (0, 0, 0), (0, world.height-world.floor, world.width, world.floor))
+        trophy = self.assets.load('resources/sprites/trophy.png', 0.5)
 
-        trophy = Image('resources/sprites/trophy.png')
-        trophy.scale(0.5)
+        world.goal = (trophy, (world.width - 100, world.height - world.floor - trophy.height))
 
-        world.background_image.surface.blit(trophy.surface, (world.width - 100, world.height - world.floor - trophy.height))
+        world.medkit = self.assets.load('resources/sprites/medkit.png', 0.2)
 
-        world.medkit = Image('resources/sprites/medkit.png')
-        world.medkit.scale(0.2)
+        world.add_medkit((world.width / 3, world.height - world.floor - world.medkit.height))
+        world.add_medkit((2 * (world.width / 3), world.height - world.floor - world.medkit.height))
 
-        world.medkits = [(world.width / 3, world.height - world.floor - world.medkit.height),
-                         (2 * (world.width / 3), world.height - world.floor - world.medkit.height)]
+    def start(self, world):
+        self.started = True
+        self.populate(world)
+        if self.render_thread:
+            return self.start_threaded(world)
 
-        cloak_text = pygame.font.SysFont(None, 36).render("Cloak Meter", 1, (255, 255, 255))
+        step_time = 1.0 / self.sim_rate
+        accumulator = 0.0
+        previous = timer()
+        profiler = self.profiler
 
         while self.started:
-            if self.narrate:
-                self.surface.fill((0, 0, 0))
-                win_text = pygame.font.SysFont(None, 200).render(self.narrate_text, 1, (255, 255, 255))
-                self.surface.blit(win_text, (self.width/2 - (win_text.get_width()/2), self.height/2 - (win_text.get_height()/2)))
-                self.tick()
+            if profiler:
+                profiler.begin()
+            if self.pacer:
+                self.pacer.begin()
+            now = timer()
+            accumulator += (now - previous) * self.time_scale
+            previous = now
+
+            narrating = self.narrate
+            if narrating:
+                self.poll()
             else:
-                self.surface.fill((0, 0, 0))
-                world.tick()
-                world.render()
-
-                # Render player cloak on top of everything else
-                self.surface.blit(cloak_text,
-                                  (30, self.height - 50 - 30 - 30))
-                pygame.draw.rect(self.surface,
-                                 (0, 0, 255),
-                                 (30, self.height - 50 - 30, world.player.cloak*2, 50))
-                self.tick()
-
-                if world.player.x + world.player.width > world.width - 50:
-                    self.putNarrative("You Win!")
-                if world.player.cloak <= 0:
-                    self.putNarrative("Game Over!")
-
-                if self.narrate:
+                accumulator = self.catch_up(world, accumulator, step_time)
+
+            frame = self.capture(world, accumulator / step_time if self.interpolate else 1.0)
+            self.present(self.draw_frame(world, frame, profiler))
+
+            if self.narrate and not narrating:
+                time.sleep(0.5)
+                previous = timer()
+
+    def start_threaded(self, world):
+        # The simulation stays on this thread, where pygame wants events read,
+        # and hands a captured frame to the render thread after every batch of
+        # steps. Frame profiles cover the simulation side only.
+        from render import RenderThread
+        self.renderer = RenderThread(self, world)
+        self.renderer.start()
+
+        step_time = 1.0 / self.sim_rate
+        accumulator = 0.0
+        previous = timer()
+        profiler = self.profiler
+
+        try:
+            while self.started:
+                if profiler:
+                    profiler.begin()
+                now = timer()
+                accumulator += (now - previous) * self.time_scale
+                previous = now
+
+                narrating = self.narrate
+                if narrating:
+                    self.poll()
+                    accumulator = 0.0
+                else:
+                    accumulator = self.catch_up(world, accumulator, step_time)
+
+                self.renderer.publish(self.capture(world, accumulator / step_time if self.interpolate else 1.0))
+                if profiler:
+                    profiler.end()
+
+                if self.narrate and not narrating:
                     time.sleep(0.5)
+                    previous = timer()
+                elif accumulator < step_time:
+                    # Sleep until the next step is due rather than waiting on the display
+                    time.sleep((step_time - accumulator) / self.time_scale)
+        finally:
+            self.renderer.stop()
+            self.renderer = None
+
+    def catch_up(self, world, accumulator, step_time):
+        # Step the simulation up to real time, skipping renders for at most
+        # max_frame_skip steps before giving up on the backlog
+        steps = 0
+        while accumulator >= step_time and not self.narrate:
+            self.step(world)
+            accumulator -= step_time
+            steps += 1
+            if steps >= self.max_frame_skip:
+                accumulator = min(accumulator, step_time)
+                break
+        return accumulator
+
+    def capture(self, world, alpha=1.0):
+        if self.narrate:
+            return RenderFrame(None, None, (), world.player.cloak, self.narrate_text)
+        return world.capture(alpha)
+
+    def draw_frame(self, world, frame, profiler=None):
+        # Draws a captured frame, returning the screen rectangles to update or None for all of it
+        if frame.narrative is not None:
+            self.surface.fill((0, 0, 0))
+            win_text = text_cache.render(frame.narrative, 200, (255, 255, 255))
+            self.surface.blit(win_text, (self.width/2 - (win_text.get_width()/2), self.height/2 - (win_text.get_height()/2)))
+            if profiler and profiler.overlay:
+                profiler.draw(self.surface)
+            return None
+
+        rects = world.draw(frame, full=not self.dirty_rects)
+        if profiler:
+            profiler.mark('render')
+
+        # Render player cloak on top of everything else
+        if self.hud is None or (frame.cloak != self.hud_cloak and (self.pacer is None or self.pacer.hud_due())):
+            self.hud = self.render_hud(frame.cloak)
+            self.hud_cloak = frame.cloak
+        hud_rects = [self.surface.blit(self.hud, (30, self.height - 50 - 30 - 30))]
+        if profiler and profiler.overlay:
+            hud_rects.append(profiler.draw(self.surface))
+        if self.dirty_rects:
+            world.dirty.extend(hud_rects)
+        if profiler:
+            profiler.mark('hud')
+        return None if rects is None else rects + hud_rects
+
+    def render_hud(self, cloak):
+        label = text_cache.render("Cloak Meter", 36, (255, 255, 255))
+        hud = pygame.Surface((max(label.get_width(), int(cloak*2)), 30 + 50), SRCALPHA)
+        hud.blit(label, (0, 0))
+        pygame.draw.rect(hud, (0, 0, 255), (0, 30, cloak*2, 50))
+        return hud
+
+    def win(self):
+        self.outcome = self.WIN
+        self.putNarrative("You Win!")
+
+    def lose(self):
+        self.outcome = self.LOSE
+        self.putNarrative("Game Over!")
 
     def putNarrative(self, text):
         self.narrate = True
@@ -132,35 +420,100 @@ class Engine(object):
     def stop(self):
         self.started = False
 
+    def record(self, path):
+        # Log every frame of input so the session can be replayed later
+        from replay import RecordingInput
+        self.input = RecordingInput(self.input, path)
+
     def quit(self):
         logging.info('Exiting')
+        if self.renderer:
+            self.renderer.stop()
+        if hasattr(self.input, 'save'):
+            self.input.save()
+        if self.profiler and self.profiler.path:
+            self.profiler.dump()
         pygame.quit()
         sys.exit()
 
 
+class TextCache(object):
+    # Fonts are loaded once and rendered text is kept in a bounded LRU, keyed
+    # on (font, size, text, color), so redrawing the same text every frame is
+    # only a dictionary lookup.
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._fonts = {}
+        self._surfaces = collections.OrderedDict()
+
+    def font(self, name, size):
+        key = (name, size)
+        if key not in self._fonts:
+            if name is None:
+                # Open pygame's default font by path; Font(None) goes through pkg_resources
+                default = os.path.join(os.path.dirname(pygame.__file__), pygame.font.get_default_font())
+                self._fonts[key] = pygame.font.Font(default if os.path.exists(default) else None, size)
+            elif os.path.exists(name):
+                self._fonts[key] = pygame.font.Font(name, size)
+            else:
+                self._fonts[key] = pygame.font.SysFont(name, size)
+        return self._fonts[key]
+
+    def render(self, text, size, color, font=None, antialias=1):
+        key = (font, size, text, color, antialias)
+        surface = self._surfaces.pop(key, None)
+        if surface is None:
+            surface = self.font(font, size).render(text, antialias, color)
+            while len(self._surfaces) >= self.max_size:
+                self._surfaces.popitem(last=False)
+        self._surfaces[key] = surface
+        return surface
+
+text_cache = TextCache()
+
+def load_surface(img_path):
+    # Decode an image file without converting it for the display, which
+    # keeps it safe to call from worker threads
+    if img_path.lower().endswith('svg'):
+        # cairosvg is slow to import, so it is only pulled in for the first SVG
+        try:
+            import cairosvg
+            from StringIO import StringIO
+        except ImportError:
+            logging.warning('SVG not supported: install cairosvg')
+            raise TypeError("Not a supported image format: SVG")
+        logging.debug('Loading SVG at {}'.format(img_path))
+        png = cairosvg.svg2png(url=img_path)
+        return pygame.image.load(StringIO(png))
+    else:
+        logging.debug('Loading raster image at {}'.format(img_path))
+        return pygame.image.load(img_path)
+
 class Image(object):
     def __init__(self, img_path):
         self._path = img_path
-
-        if self._path.lower().endswith('svg'):
-            if SVG_ENABLED:
-                logging.debug('Loading SVG at {}'.format(self._path))
-                png = cairosvg.svg2png(url=self._path)
-                self.surface = pygame.image.load(StringIO(png)).convert_alpha()
-            else:
-                logging.warning('SVG not supported: install cairosvg')
-                raise TypeError("Not a supported image format: SVG")
-        else:
-            logging.debug('Loading raster image at {}'.format(self._path))
-            self.surface = pygame.image.load(self._path).convert_alpha()
+        self.surface = load_surface(self._path).convert_alpha()
 
         self.width = self.surface.get_width()
         self.height = self.surface.get_height()
+        self._variants = {}
+
+    @classmethod
+    def from_surface(cls, surface, img_path=''):
+        # Wrap an already decoded surface without touching the disk
+        image = cls.__new__(cls)
+        image._path = img_path
+        image.surface = surface
+        image.width = surface.get_width()
+        image.height = surface.get_height()
+        image._variants = {}
+        return image
 
     def resize(self, width, height):
         self.surface = pygame.transform.scale(self.surface, (width, height))
         self.width = width
         self.height = height
+        self._variants = {}
 
     def scale(self, percent):
         new_width = int(self.width * percent)
@@ -168,6 +521,110 @@ class Image(object):
 
         self.resize(new_width, new_height)
 
+    def get_surface(self, flipped=False, alpha=255):
+        # Mirrored and faded copies are built once and shared by every user of
+        # the image. Fading scales the per-pixel alpha, so drawing a faded
+        # sprite is one ordinary alpha blit.
+        if not flipped and alpha == 255:
+            return self.surface
+        key = (flipped, alpha)
+        if key not in self._variants:
+            if alpha == 255:
+                surface = pygame.transform.flip(self.surface, True, False)
+            else:
+                surface = self.get_surface(flipped)
+                surface = surface.copy() if surface.get_flags() & SRCALPHA else surface.convert_alpha()
+                surface.fill((255, 255, 255, alpha), special_flags=BLEND_RGBA_MULT)
+            self._variants[key] = surface
+        return self._variants[key]
+
+    def blit_area(self, surface, dest, area):
+        surface.blit(self.surface, dest, area)
+
+    def prefetch(self, x, width, direction):
+        pass
+
+    def fit_viewport(self, width):
+        pass
+
+class TiledImage(object):
+    # A level background cut into equally wide vertical strips. Tiles are only
+    # decoded when the camera reaches them and are kept in a bounded LRU cache,
+    # so memory depends on the viewport size and not on the level width.
+    # Prefetched tiles are decoded on a worker thread and only converted for
+    # the display when they are first drawn.
+    _executor = None
+
+    def __init__(self, tile_paths, cache_size=4):
+        self._paths = list(tile_paths)
+        self.cache_size = max(cache_size, 2)
+        self._tiles = collections.OrderedDict()
+        self._decoding = collections.OrderedDict()
+
+        self.tile_width = self.tile(0).get_width()
+        self.height = self.tile(0).get_height()
+        self.width = self.tile_width * (len(self._paths) - 1) + self.tile(len(self._paths) - 1).get_width()
+
+    @classmethod
+    def from_directory(cls, directory, cache_size=4):
+        names = sorted(name for name in os.listdir(directory) if name.startswith('tile_'))
+        return cls([os.path.join(directory, name) for name in names], cache_size)
+
+    @staticmethod
+    def split(img_path, directory, tile_width=1024):
+        # One-off conversion of a monolithic background into tiles
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        surface = pygame.image.load(img_path)
+        paths = []
+        for i, x in enumerate(xrange(0, surface.get_width(), tile_width)):
+            width = min(tile_width, surface.get_width() - x)
+            path = os.path.join(directory, 'tile_{:04d}.png'.format(i))
+            pygame.image.save(surface.subsurface((x, 0, width, surface.get_height())), path)
+            paths.append(path)
+        return paths
+
+    def tile(self, index):
+        surface = self._tiles.pop(index, None)
+        if surface is None:
+            decoding = self._decoding.pop(index, None)
+            if decoding is None:
+                logging.debug('Loading background tile {}'.format(self._paths[index]))
+                surface = load_surface(self._paths[index]).convert_alpha()
+            else:
+                surface = decoding.result().convert_alpha()
+            while len(self._tiles) >= self.cache_size:
+                self._tiles.popitem(last=False)
+        self._tiles[index] = surface
+        return surface
+
+    def blit_area(self, surface, dest, area):
+        x, y, width, height = area
+        first = max(int(x) // self.tile_width, 0)
+        last = min(int(x + width - 1) // self.tile_width, len(self._paths) - 1)
+        for index in xrange(first, last + 1):
+            tile_x = index * self.tile_width
+            surface.blit(self.tile(index), (dest[0] + tile_x - x, dest[1]), (0, y, self.tile_width, height))
+
+    def fit_viewport(self, width):
+        # A viewport can straddle one more tile than it is wide, plus the
+        # prefetched one, and a smaller cache would reload tiles every frame
+        self.cache_size = max(self.cache_size, -(-width // self.tile_width) + 2)
+
+    def prefetch(self, x, width, direction):
+        # Warm the tile just past the viewport edge the player is heading to
+        edge = x + width if direction > 0 else x - 1
+        index = int(edge) // self.tile_width
+        if 0 <= index < len(self._paths) and index not in self._tiles and index not in self._decoding:
+            if TiledImage._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                TiledImage._executor = ThreadPoolExecutor(max_workers=1)
+            logging.debug('Prefetching background tile {}'.format(self._paths[index]))
+            self._decoding[index] = TiledImage._executor.submit(load_surface, self._paths[index])
+            # Forget prefetches the camera turned away from
+            while len(self._decoding) > 2:
+                self._decoding.popitem(last=False)
+
 class World(object):
     def __init__(self, background_image, player, engine, x=0, y=0, floor=0, gravity=-2):
         self.background_image = background_image
@@ -175,36 +632,228 @@ class World(object):
         self.engine = engine
         self.x = x
         self.y = y
+        self.prev_x = x
 
         self.width = self.background_image.width
         self.height = self.background_image.height
+        self.background_image.fit_viewport(self.engine.width)
 
         self.floor = floor
         self.gravity = gravity
 
-        self.enemies = []
-        self.statics = []
-        self.medkits = []
+        # Checked before each per-frame debug log so they cost nothing when off
+        self.debug = logging.getLogger().isEnabledFor(logging.DEBUG)
 
+        self.enemies = EntityPool(PatrollingEnemy)
+        self.statics = []
+        self.medkits = EntityPool(Pickup)
+        self.goal = None
+        self.detected_at = None
+        # Set when the world is streamed from a level file (see level.py)
+        self.level = None
+
+        # Screen rectangles drawn last frame, for dirty-rect rendering
+        self.dirty = []
+        self.last_camera_x = None
+
+        # Spatial indexes so per-frame queries only touch nearby entities
+        self.enemy_index = SpatialGrid()
+        self.static_index = SpatialGrid()
+        self.medkit_index = SpatialGrid()
+        self.view_distance = 0
+        self.enemy_batch = None
+
+        self.engine.watch_key(K_DOWN)
         self.move_player(0, 0)
 
+    def add_enemy(self, enemy):
+        self.enemies.add(enemy)
+        return self._track_enemy(enemy)
+
+    def spawn_enemy(self, *args, **kwargs):
+        # Same arguments as PatrollingEnemy, but reuses a removed enemy when there is one
+        return self._track_enemy(self.enemies.spawn(*args, **kwargs))
+
+    def _track_enemy(self, enemy):
+        self.enemy_index.insert(enemy, enemy.x, enemy.y, enemy.width, enemy.height)
+        enemy.walls = None
+        self.view_distance = max(self.view_distance, enemy.view_distance)
+        if self.enemy_batch is not None:
+            self.enemy_batch.append(enemy)
+        return enemy
+
+    def remove_enemy(self, enemy, recycle=True):
+        if recycle:
+            self.enemies.despawn(enemy)
+        else:
+            self.enemies.remove(enemy)
+        self.enemy_index.remove(enemy)
+        if self.enemy_batch is not None:
+            self.enemy_batch.remove(enemy)
+
+    def batch_enemies(self):
+        # Simulate all enemies with NumPy instead of one object at a time.
+        # Batched patrols do not collide with statics.
+        from batch import EnemyBatch
+        self.enemy_batch = EnemyBatch(self.enemies)
+
+    def add_static(self, static):
+        self.statics.append(static)
+        self.static_index.insert(static, static.x, static.y, static.width, static.height)
+
+    def patrol_walls(self, enemy, x):
+        # The nearest static edges left and right of an enemy at x that its patrol
+        # can run into. Patrols only move sideways and never get further than
+        # a step outside their patrol area, so only that stretch of the
+        # enemy's row is looked at. Statics an enemy starts inside of do not
+        # block it.
+        reach = 2 * enemy.speed
+        left = min(x, enemy.patrol_area_left) - reach
+        right = max(x, enemy.patrol_area_right + enemy.width) + enemy.width + reach
+        wall_left, wall_right = -collision.INFINITY, collision.INFINITY
+        for static in self.static_index.query(left, enemy.y, right - left, enemy.height, ordered=False):
+            if static.y < enemy.y + enemy.height and static.y + static.height > enemy.y:
+                if static.x + static.width <= x:
+                    wall_left = max(wall_left, static.x + static.width)
+                elif static.x >= x + enemy.width:
+                    wall_right = min(wall_right, static.x)
+        return wall_left, wall_right
+
+    def add_medkit(self, coords):
+        pickup = self.medkits.spawn(coords[0], coords[1], self.medkit.width, self.medkit.height)
+        self.medkit_index.insert(pickup, pickup.x, pickup.y, pickup.width, pickup.height)
+        return pickup
+
+    def remove_medkit(self, pickup):
+        self.medkits.despawn(pickup)
+        self.medkit_index.remove(pickup)
+
+    def snapshot(self):
+        # Everything a simulation step can change, packed with struct so that
+        # taking and restoring one is cheap even with thousands of entities
+        if self.enemy_batch is not None:
+            self.enemy_batch.sync_all()
+        player = self.player
+        detected = self.detected_at is not None
+        detected_x, detected_y = self.detected_at if detected else (0, 0)
+        loaded, (first, last) = self.level.snapshot() if self.level is not None else (0, (0, -1))
+        enemies = self.all_enemies()
+        count = len(enemies)
+        medkits = [coord for pickup in self.medkits for coord in (pickup.x, pickup.y)]
+
+        return b''.join((
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.x, self.prev_x,
+                                 detected, detected_x, detected_y,
+                                 player.x, player.y, player.prev_x, player.prev_y, player.dy,
+                                 player.jumping, player.visible, player.cloak, player.facing,
+                                 self.level is not None, loaded, first, last,
+                                 count, len(medkits) // 2),
+            struct.pack('<{}d'.format(count), *[enemy.x for enemy in enemies]),
+            struct.pack('<{}d'.format(count), *[enemy.prev_x for enemy in enemies]),
+            struct.pack('<{}B'.format(count), *[(enemy.facing > 0) | (enemy.image is enemy.detected_image) << 1
+                                                for enemy in enemies]),
+            struct.pack('<{}d'.format(len(medkits)), *medkits),
+        ))
+
+    def restore(self, state):
+        (magic, version, self.x, self.prev_x, detected, detected_x, detected_y,
+         player_x, player_y, player_prev_x, player_prev_y, player_dy,
+         player_jumping, player_visible, player_cloak, player_facing,
+         has_level, loaded, first, last, count, medkit_count) = SNAPSHOT_HEADER.unpack_from(state)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('Not a version {} world snapshot'.format(SNAPSHOT_VERSION))
+        # Enemies are matched up by position in all_enemies, so the roster has
+        # to be the one the snapshot was taken with. Chunks a level streams in
+        # later are reset by the level instead.
+        if has_level != (self.level is not None):
+            raise ValueError('Snapshot and world disagree on having a level')
+        if has_level:
+            known = sum(len(chunk.enemies) for chunk in self.level.chunks[:loaded]) if loaded <= len(self.level.chunks) else -1
+        else:
+            known = len(self.enemies)
+        if count != known:
+            raise ValueError('Snapshot has {} enemies, the world has {}'.format(count, known))
+
+        self.detected_at = (detected_x, detected_y) if detected else None
+        player = self.player
+        (player.x, player.y, player.prev_x, player.prev_y, player.dy,
+         player.jumping, player.visible, player.cloak, player.facing) = (
+            player_x, player_y, player_prev_x, player_prev_y, player_dy,
+            player_jumping, player_visible, player_cloak, player_facing)
+
+        if has_level:
+            self.level.restore((loaded, (first, last)))
+
+        offset = SNAPSHOT_HEADER.size
+        xs = struct.unpack_from('<{}d'.format(count), state, offset)
+        offset += 8 * count
+        prev_xs = struct.unpack_from('<{}d'.format(count), state, offset)
+        offset += 8 * count
+        flags = struct.unpack_from('<{}B'.format(count), state, offset)
+        offset += count
+
+        # Only enemies that changed grid columns need the index updated, and
+        # dormant level enemies are not in it at all
+        index = self.enemy_index
+        size = index.cell_size
+        ranges = index.ranges
+        for enemy, x, prev_x, flag in zip(self.all_enemies(), xs, prev_xs, flags):
+            enemy.x = x
+            enemy.prev_x = prev_x
+            enemy.facing = Direction.RIGHT if flag & 1 else Direction.LEFT
+            enemy.image = enemy.detected_image if flag & 2 else enemy.normal_image
+            cells = ranges.get(enemy)
+            if cells is not None and (int(x // size) != cells[0] or int((x + enemy.width) // size) != cells[2]):
+                index.update(enemy, x, enemy.y, enemy.width, enemy.height)
+        if self.enemy_batch is not None:
+            self.enemy_batch.reload()
+
+        # Pickups keep their pool order, so the ones still around are moved
+        # in place and only the difference is despawned or spawned
+        medkits = struct.unpack_from('<{}d'.format(2 * medkit_count), state, offset)
+        pickups = self.medkits.active
+        for pickup in reversed(pickups[medkit_count:]):
+            self.remove_medkit(pickup)
+        for pickup, x, y in zip(pickups, medkits[0::2], medkits[1::2]):
+            if pickup.x != x or pickup.y != y:
+                pickup.x = x
+                pickup.y = y
+                self.medkit_index.update(pickup, x, y, pickup.width, pickup.height)
+        for index in xrange(2 * len(pickups), len(medkits), 2):
+            self.add_medkit(medkits[index:index + 2])
+        if has_level:
+            self.level.restore_medkits((loaded, (first, last)))
+
+    def all_enemies(self):
+        # Dormant level enemies are not in self.enemies but still have state to save
+        return self.level.enemies if self.level is not None else self.enemies
+
     def move_player(self, dx, dy):
-        self.player.x += dx
-        self.player.y += dy
+        for static, normal_x, normal_y in collision.move(self.player, dx, dy, self.static_index):
+            if self.debug:
+                logging.debug('Collision with player')
+            if normal_y:
+                self.player.dy = 0
+                if normal_y > 0:
+                    self.player.jumping = False
 
         # Prevent movement outside of the background
         if self.player.x < 0:
-            logging.debug('Limiting player x- movement')
+            if self.debug:
+                logging.debug('Limiting player x- movement')
             self.player.x = 0
         elif self.player.x + self.player.width > self.width:
-            logging.debug('Limiting player x+ movement')
+            if self.debug:
+                logging.debug('Limiting player x+ movement')
             self.player.x = self.width - self.player.width
 
         if self.player.y < self.floor:
-            logging.debug('Limiting player y- movement')
+            if self.debug:
+                logging.debug('Limiting player y- movement')
             self.player.y = self.floor
         if self.player.y + self.player.height > self.height:
-            logging.debug('Limiting player y+ movement')
+            if self.debug:
+                logging.debug('Limiting player y+ movement')
             self.player.y = self.height - self.player.height
 
         player_screen_x = self.player.x - self.x
@@ -213,103 +862,249 @@ class World(object):
         right_cutoff = self.engine.width*2/3
 
         if player_screen_x < left_cutoff:
-            logging.debug('Sliding left to match player')
+            if self.debug:
+                logging.debug('Sliding left to match player')
             self.x = self.player.x - left_cutoff
         elif player_screen_x + self.player.width > right_cutoff:
-            logging.debug('Sliding right to match player')
+            if self.debug:
+                logging.debug('Sliding right to match player')
             self.x = self.player.x - right_cutoff + self.player.width
 
         if self.x < 0:
-            logging.debug('Limiting background x- movement')
+            if self.debug:
+                logging.debug('Limiting background x- movement')
             self.x = 0
         elif self.x > self.width - self.engine.width:
-            logging.debug('Limiting background x+ movement')
+            if self.debug:
+                logging.debug('Limiting background x+ movement')
             self.x = self.width - self.engine.width
 
 
+    def begin_step(self):
+        # Remember where things were so rendering can interpolate
+        self.prev_x = self.x
+        self.player.prev_x = self.player.x
+        self.player.prev_y = self.player.y
+
     def player_walk(self, direction):
         if self.player.visible:
             self.move_player(direction*self.player.speed, 0)
-            if direction != self.player.facing:
-                self.player.facing = direction
-                self.player.image.surface = pygame.transform.flip(self.player.image.surface, True, False)
+            self.player.facing = direction
 
     def player_jump(self):
         if not self.player.jumping and self.player.visible:
-            logging.debug('Jump')
+            if self.debug:
+                logging.debug('Jump')
             self.player.dy = -self.gravity * 15
             self.player.jumping = True
-            self.player.y += self.player.dy
+            self.move_player(0, self.player.dy)
 
     def tick(self):
+        if self.level is not None:
+            self.level.update()
+
         if self.player.y > self.floor:
-            logging.debug('In air')
+            if self.debug:
+                logging.debug('In air')
             self.move_player(0, self.player.dy)
             self.player.dy += self.gravity
 
             if self.player.y <= self.floor:
-                logging.debug('Landed')
+                if self.debug:
+                    logging.debug('Landed')
                 self.player.dy = 0
                 self.player.jumping = False
 
-        if pygame.key.get_pressed()[K_DOWN]:
-            logging.debug('Hiding')
+        if self.engine.key_down(K_DOWN):
+            if self.debug:
+                logging.debug('Hiding')
             self.player.visible = False
             self.player.cloak -= 0.5
         else:
             self.player.visible = True
 
-        for static in self.statics:
-            new_pos = static.colliding(self.player)
-            if new_pos:
-                logging.debug('Collision with player')
-                if self.player.y != new_pos[1]:
-                    self.player.dy = 0
-                    self.player.jumping = False
-                self.player.x = new_pos[0]
-                self.player.y = new_pos[1]
+        # Pick up every medkit the player has reached
+        for pickup in self.medkit_index.query(self.x, 0, self.player.x + self.player.width - self.x, self.height):
+            if self.player.x + self.player.width >= pickup.x:
+                self.player.cloak += 50
+                self.remove_medkit(pickup)
 
+        if self.enemy_batch is not None:
+            for index in self.enemy_batch.step(self.player):
+                self.player_spotted(self.enemy_batch.sync(index))
+            return
+
+        statics = len(self.statics)
+        index = self.enemy_index
+        size = index.cell_size
+        ranges = index.ranges
         for enemy in self.enemies:
+            enemy.prev_x = enemy.x
             enemy.move(self.player)
+            if statics:
+                # Patrols turn back at walls instead of walking through them.
+                # Walls are only worked out again once statics have been added.
+                walls = enemy.walls
+                if walls is None or walls[0] != statics:
+                    walls = enemy.walls = (statics,) + self.patrol_walls(enemy, enemy.prev_x)
+                if enemy.x + enemy.width >= walls[2] and enemy.x > enemy.prev_x:
+                    enemy.x = walls[2] - enemy.width
+                    enemy.facing = -enemy.facing
+                elif enemy.x <= walls[1] and enemy.x < enemy.prev_x:
+                    enemy.x = walls[1]
+                    enemy.facing = -enemy.facing
+            # Patrols stay in their row, so only a change of column needs the grid updated
+            cells = ranges[enemy]
+            if int(enemy.x // size) != cells[0] or int((enemy.x + enemy.width) // size) != cells[2]:
+                index.update(enemy, enemy.x, enemy.y, enemy.width, enemy.height)
+
+        # Only enemies within the longest view distance can possibly see the
+        # player. Being seen by any of them is the same, so order does not matter.
+        nearby = index.query(self.player.x - self.view_distance, self.player.y - 60,
+                             self.player.width + 2*self.view_distance, self.player.height + 120, ordered=False)
+        for enemy in nearby:
             if enemy.can_see(self.player):
                 self.player_spotted(enemy)
 
     def player_spotted(self, enemy):
         logging.debug("Player spotted")
+        if self.detected_at is None:
+            self.detected_at = (self.player.x, self.player.y)
         if enemy.detected_image and enemy.image != enemy.detected_image:
             enemy.image = enemy.detected_image
         self.lose()
 
     def lose(self):
-        self.engine.putNarrative("Game Over!")
+        self.engine.lose()
+
+    def on_screen(self, x, width, camera_x):
+        return x + width > camera_x and x < camera_x + self.engine.width
+
+    def lerp_offset(self, character, offset, alpha):
+        # Draw a character between its previous and current step positions
+        return (offset[0] + (character.x - character.prev_x) * (1 - alpha),
+                offset[1] + (character.y - character.prev_y) * (1 - alpha))
+
+    def draw_background(self, camera_x):
+        surface = self.engine.surface
+        surface.fill((0, 0, 0))
+        self.background_image.blit_area(surface, (0, self.y), (camera_x, 0, self.engine.width, self.height))
+        pygame.draw.rect(surface, (0, 0, 0), (0, self.height - self.floor + self.y, self.engine.width, self.floor))
+
+    def restore_area(self, rect, camera_x):
+        # Redraw the background underneath a single screen rectangle
+        surface = self.engine.surface
+        surface.set_clip(rect)
+        self.draw_background(camera_x)
+        surface.set_clip(None)
+
+    def render(self, alpha=1.0, full=True):
+        return self.draw(self.capture(alpha), full)
+
+    def capture(self, alpha=1.0):
+        # Everything the next frame shows, as plain screen-space draw calls so
+        # that it can be drawn later, or on another thread, while the world
+        # keeps changing. Only what can be seen from the camera is captured.
+        # With alpha < 1 the camera and characters are interpolated from the
+        # previous step.
+        screen_height = self.engine.height
+        camera_x = self.x if alpha >= 1 else self.prev_x + (self.x - self.prev_x) * alpha
+        offset = (camera_x, self.y + self.height - screen_height)
+        player = self.player
+        ops = []
+
+        if self.goal:
+            image, coords = self.goal
+            if self.on_screen(coords[0], image.width, camera_x):
+                ops.append((BLIT, image.surface, (coords[0] - camera_x, coords[1] + self.y)))
+
+        player_offset = offset if alpha >= 1 else self.lerp_offset(player, offset, alpha)
+        ops.append((BLIT, player.current_surface(),
+                    (player.x - player_offset[0], screen_height - player.y - player.height + player_offset[1])))
+
+        for static in self.static_index.query(camera_x, 0, self.engine.width, self.height):
+            if self.on_screen(static.x, static.width, camera_x):
+                ops.append((RECT, static.color,
+                            (static.x - offset[0], screen_height - static.y - static.height + offset[1], static.width, static.height), 0))
+
+        # Vision outlines can reach into the viewport from off-screen enemies,
+        # unless the frame pacer has dropped them
+        pacer = self.engine.pacer
+        vision = not player.visible and (pacer is None or pacer.vision_outlines)
+        margin = self.view_distance if vision and (pacer is None or pacer.offscreen_enemies) else 0
+        if self.enemy_batch is not None:
+            visible_enemies = [self.enemy_batch.sync(index) for index in
+                               self.enemy_batch.in_range(camera_x - margin, camera_x + self.engine.width + margin)]
+        else:
+            visible_enemies = self.enemy_index.query(camera_x - margin, 0,
+                                                     self.engine.width + 2*margin, self.height)
+        for enemy in visible_enemies:
+            enemy_offset = offset if alpha >= 1 else self.lerp_offset(enemy, offset, alpha)
+            if self.on_screen(enemy.x, enemy.width, camera_x):
+                ops.append((BLIT, enemy.current_surface(),
+                            (enemy.x - enemy_offset[0], screen_height - enemy.y - enemy.height + enemy_offset[1])))
+            if vision:
+                vision_end = enemy.x + enemy.facing * enemy.view_distance
+                vision_left = min(enemy.x, vision_end)
+                if self.on_screen(vision_left, abs(enemy.x - vision_end) + enemy.width, camera_x):
+                    ops.append((RECT, (255, 0, 0),
+                                (enemy.x + enemy.width*(enemy.facing == Direction.RIGHT) - enemy_offset[0],
+                                 screen_height - enemy.y + enemy_offset[1], enemy.view_distance*enemy.facing, -enemy.height), 10))
+
+        for pickup in self.medkit_index.query(camera_x, 0, self.engine.width, self.height):
+            if self.on_screen(pickup.x, pickup.width, camera_x):
+                ops.append((BLIT, self.medkit.surface, (pickup.x - camera_x, pickup.y + self.y)))
+
+        return RenderFrame(camera_x, player.facing, tuple(ops), player.cloak, None)
+
+    def draw(self, frame, full=True):
+        # Only the visible slice of the background is blitted, the captured
+        # draw calls go straight to the screen.
+        #
+        # With full=False and a camera that has not moved, only the background
+        # under last frame's draw calls is restored, and the changed screen
+        # rectangles are returned for pygame.display.update. Otherwise the
+        # whole frame is drawn and None is returned.
+        surface = self.engine.surface
+        camera_x = frame.camera_x
+
+        full = full or camera_x != self.last_camera_x
+        previous = self.dirty
+        self.dirty = dirty = []
+        self.last_camera_x = camera_x
+
+        if full:
+            self.draw_background(camera_x)
+        else:
+            for rect in previous:
+                self.restore_area(rect, camera_x)
+        self.background_image.prefetch(camera_x, self.engine.width, frame.facing)
 
-    def render(self):
-        # Render everything in its absolute position to a copy of the background
-        abs_pos_surface = self.background_image.surface.copy()
-        self.player.blit_to(abs_pos_surface)
+        for op in frame.ops:
+            if op[0] == BLIT:
+                dirty.append(surface.blit(op[1], op[2]))
+            else:
+                kind, color, rect, width = op
+                dirty.append(pygame.draw.rect(surface, color, rect, width))
 
-        for static in self.statics:
-            static.blit_to(abs_pos_surface)
+        if full:
+            return None
+        return previous + dirty
 
-        for enemy in self.enemies:
-            enemy.blit_to(abs_pos_surface)
-            if not self.player.visible:
-                vision_end = enemy.x + enemy.facing * enemy.view_distance
-                if (enemy.x > self.x or vision_end > self.x) and (enemy.x < self.x + self.width or vision_end < self.x + self.width):
-                    enemy.blit_vision_to(abs_pos_surface)
 
-        for coords in self.medkits:
-            if self.player.x + self.player.width >= coords[0]:
-                self.player.cloak += 50
-                self.medkits.remove(coords)
-            else:
-                abs_pos_surface.blit(self.medkit.surface, coords)
+class Pickup(object):
+    __slots__ = ('x', 'y', 'width', 'height', '_pool_index')
 
-        # Then blit the background on the screen where it needs to be
-        self.engine.surface.blit(abs_pos_surface, (-self.x, self.y))
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
 
 
 class StaticRect(object):
+    __slots__ = ('x', 'y', 'width', 'height', 'color')
+
     def __init__(self, x, y, width, height, color=(255, 255, 255)):
         self.x = x
         self.y = y
@@ -334,36 +1129,40 @@ class StaticRect(object):
 
         return None
 
-    def blit_to(self, surface):
-        pygame.draw.rect(surface, self.color, (self.x, surface.get_height() - self.y - self.height, self.width, self.height), 0)
+    def blit_to(self, surface, offset=(0, 0)):
+        return pygame.draw.rect(surface, self.color, (self.x - offset[0], surface.get_height() - self.y - self.height + offset[1], self.width, self.height), 0)
 
 class Menu:
-    lista = []
-    pola = []
-    title = None
-    font_size = 32
-    font_path = 'resources/font/coders_crux.ttf'
-    font = pygame.font.Font
-    dest_surface = pygame.Surface
-    pol_count = 0
-    background_color = (51,51,51)
-    text_color =  (255, 255, 255)
-    color_selection = (0,0,0)
-    item_selection = 0
-    position_paste = (0,0)
-    menu_width = 0
-    menu_height = 0
+    # Colours and fonts are set before init(), which lays the menu out and
+    # renders it once for every selected item, so draw() is a single blit
+    def __init__(self):
+        self.lista = []
+        self.pola = []
+        self.surfaces = []
+        self.title = None
+        self.font_size = 32
+        self.font_path = 'resources/font/coders_crux.ttf'
+        self.font = None
+        self.dest_surface = None
+        self.pol_count = 0
+        self.background_color = (51,51,51)
+        self.text_color =  (255, 255, 255)
+        self.color_selection = (0,0,0)
+        self.item_selection = 0
+        self.position_paste = (0,0)
+        self.menu_width = 0
+        self.menu_height = 0
 
     class Title:
         text = ''
-        box = pygame.Surface
-        container = pygame.Rect
+        box = None
+        container = None
 
     class Pole:
         text = ''
-        pole = pygame.Surface
-        pole_rect = pygame.Rect
-        selection_rect = pygame.Rect
+        pole = None
+        pole_rect = None
+        selection_rect = None
 
     def move_menu(self, top, left):
         self.position_paste = (top,left)
@@ -394,26 +1193,30 @@ class Menu:
             if self.item_selection == -1:
                 self.item_selection = self.pol_count - 1
             self.item_selection %= self.pol_count
-        menu = pygame.Surface((self.menu_width, self.menu_height))
+        self.dest_surface.blit(self.surfaces[self.item_selection],self.position_paste)
+        return self.item_selection
+
+    def render(self, selection):
+        menu = pygame.Surface((self.menu_width, self.menu_height)).convert()
         menu.fill(self.background_color)
-        selection_rect = self.pola[self.item_selection].selection_rect
-        pygame.draw.rect(menu,self.color_selection,selection_rect)
+        pygame.draw.rect(menu,self.color_selection,self.pola[selection].selection_rect)
 
         menu.blit(self.title.box,self.title.container)
 
         for i in xrange(self.pol_count):
             menu.blit(self.pola[i].pole,self.pola[i].pole_rect)
-        self.dest_surface.blit(menu,self.position_paste)
-        return self.item_selection
+        return menu
 
     def create_struct(self):
         shift = 0
+        self.pola = []
+        self.menu_width = 0
         self.menu_height = 0
-        self.font = pygame.font.Font(self.font_path, self.font_size)
+        self.font = text_cache.font(self.font_path, self.font_size)
 
         self.title = self.Title()
         self.title.text = "Incognito"
-        self.title.box = self.font.render(self.title.text, 1, self.text_color)
+        self.title.box = text_cache.render(self.title.text, self.font_size, self.text_color, self.font_path)
         self.title.container = self.title.box.get_rect()
         self.title.container.left = self.font_size * 0.5
         self.title.container.top = (self.font_size * 0.5) + ((self.font_size * 0.5) * 2 + self.title.container.height)
@@ -421,7 +1224,7 @@ class Menu:
         for i in xrange(self.pol_count):
             self.pola.append(self.Pole())
             self.pola[i].text = self.lista[i]
-            self.pola[i].pole = self.font.render(self.pola[i].text, 1, self.text_color)
+            self.pola[i].pole = text_cache.render(self.pola[i].text, self.font_size, self.text_color, self.font_path)
 
             self.pola[i].pole_rect = self.pola[i].pole.get_rect()
             shift = int(self.font_size * 0.2)
@@ -443,3 +1246,4 @@ class Menu:
         y = self.dest_surface.get_rect().centery - self.menu_height / 2
         mx, my = self.position_paste
         self.position_paste = (x+mx, y+my)
+        self.surfaces = [self.render(i) for i in xrange(self.pol_count)]
@@ -1,30 +1,20 @@
 from core import *
 import characters
+from level import Level, load_level
 
 logging.basicConfig(level=logging.WARNING)
 
-game = Engine(1280, 720, '1122 Game')
-game.register_key_handler(ord('q'), lambda: game.quit())
+LEVEL = 'resources/levels/level1.jsonl'
 
-player_img = Image('resources/sprites/player.png')
-player_img.scale(0.25)
+def build_world(game, level=LEVEL):
+    # level is a level file, or a Level that has already started loading
+    world = level.build_world() if isinstance(level, Level) else load_level(level, game)
 
-player = characters.Player(player_img)
+    game.register_key_handler(K_UP, lambda: world.player_jump())
+    game.register_key_handler(K_LEFT, lambda: world.player_walk(characters.Direction.LEFT))
+    game.register_key_handler(K_RIGHT, lambda: world.player_walk(characters.Direction.RIGHT))
 
-world = World(Image('resources/background_images/bkg.png'), player, game, floor=200)
-
-game.register_key_handler(K_UP, lambda: world.player_jump())
-game.register_key_handler(K_LEFT, lambda: world.player_walk(characters.Direction.LEFT))
-game.register_key_handler(K_RIGHT, lambda: world.player_walk(characters.Direction.RIGHT))
-
-enemy_image = Image('resources/sprites/enemy.png')
-enemy_image.scale(0.25)
-
-enemy_detected_image = Image('resources/sprites/enemy_detected.png')
-enemy_detected_image.scale(0.25)
-
-for i in range(2, 10, 2):
-    world.enemies.append(characters.PatrollingEnemy(enemy_image, x=1000*i, y=200, detected_image=enemy_detected_image))
+    return world
 
 
 # while True:
@@ -53,4 +43,23 @@ for i in range(2, 10, 2):
 # menu.init(['Start','Quit'], surface)
 # menu.draw()
 
-game.init(world)
+if __name__ == '__main__':
+    # python game.py [--record session.log | --replay session.log] [--profile timings.csv] [--threaded] [--adaptive]
+    args = sys.argv[1:]
+    game = Engine(1280, 720, '1122 Game', icon='resources/sprites/player.png', render_thread='--threaded' in args)
+    game.register_key_handler(ord('q'), lambda: game.quit())
+
+    # Only the level header is read here, its sprites load while the menu is up
+    level = Level(LEVEL, game)
+
+    if '--record' in args:
+        game.record(args[args.index('--record') + 1])
+    elif '--replay' in args:
+        from replay import InputLog, ReplayInput
+        game.input = ReplayInput(InputLog.load(args[args.index('--replay') + 1]))
+    if '--profile' in args:
+        game.profile(args[args.index('--profile') + 1], overlay=True)
+    if '--adaptive' in args:
+        game.pace()
+
+    game.init(lambda: build_world(game, level))
@@ -0,0 +1,177 @@
+import os, json
+import characters
+from core import World, StaticRect, TiledImage
+
+# Levels are JSON lines. The first line is a header:
+#   {"format": "incognito-level", "version": 1, "chunk_width": 2048, "floor": 200,
+#    "background": "bkg.png", "tiles": "bkg/", "sprites": {"player": ["player.png", 0.25], ...},
+#    "player": {"x": 0, "y": 0}, "goal": {"sprite": "goal", "x": 9900, "y": 300}}
+# and every other line is one chunk, in increasing chunk order:
+#   {"chunk": 1, "enemies": [{"x": 2000, "y": 200, "detected_sprite": "enemy_detected"}],
+#    "statics": [{"x": 2100, "y": 350, "width": 100, "height": 20}], "medkits": [[2400, 200]]}
+# Entities belong to the chunk their x falls in (x // chunk_width). Enemy and
+# static fields are the PatrollingEnemy and StaticRect arguments.
+# Every y in the file is measured up from the bottom of the level to the
+# bottom of the sprite, like character positions. Medkits and the goal are
+# kept in screen coordinates (top down) by World, and converted on loading.
+# "tiles" is used instead of "background" when the directory exists, and
+# "goal" may be left out to let Engine.populate place the trophy. The
+# "medkit" and "goal" sprites default to the ones Engine.populate uses.
+FORMAT = 'incognito-level'
+VERSION = 1
+DEFAULT_SPRITES = {
+    'medkit': ['resources/sprites/medkit.png', 0.2],
+    'goal': ['resources/sprites/trophy.png', 0.5],
+}
+
+
+class Chunk(object):
+    __slots__ = ('index', 'enemies', 'spawns', 'medkits', 'active')
+
+    def __init__(self, index):
+        self.index = index
+        self.enemies = []
+        self.spawns = []
+        self.medkits = []
+        self.active = False
+
+    def reset(self):
+        # Put the enemies back where the level file has them
+        for enemy, (args, kwargs) in zip(self.enemies, self.spawns):
+            enemy.__init__(*args, **kwargs)
+
+
+class Level(object):
+    # Streams a level into a World one chunk at a time: chunk lines are only
+    # read once the camera gets near them. Enemies in chunks further than
+    # active_margin from the screen are dormant, taken out of the world so
+    # they are neither moved nor checked for line of sight until the camera
+    # comes back.
+    def __init__(self, path, engine, active_margin=None):
+        self.path = path
+        self.engine = engine
+        self.level_file = open(path)
+        header = json.loads(self.level_file.readline())
+        if header.get('format') != FORMAT:
+            raise ValueError('Not a level file: {}'.format(path))
+        if header.get('version') != VERSION:
+            raise ValueError('Unsupported level version {}'.format(header.get('version')))
+
+        sprites = dict(DEFAULT_SPRITES)
+        sprites.update(header['sprites'])
+        header['sprites'] = sprites
+        self.header = header
+        self.chunk_width = header['chunk_width']
+        self.active_margin = self.chunk_width if active_margin is None else active_margin
+        self.chunks = []
+        self.enemies = []
+        self.active = (0, -1)
+        self.world = None
+        engine.assets.preload(tuple(sprite) for sprite in header['sprites'].values())
+        if not self.tiled():
+            engine.assets.preload([(header['background'], None)], cache=False)
+
+    def tiled(self):
+        tiles = self.header.get('tiles')
+        return bool(tiles) and os.path.isdir(tiles)
+
+    def sprite(self, name):
+        path, scale = self.header['sprites'][name]
+        return self.engine.assets.load(path, scale)
+
+    def build_world(self):
+        header = self.header
+        if self.tiled():
+            background = TiledImage.from_directory(header['tiles'])
+        else:
+            background = self.engine.assets.load(header['background'], cache=False)
+
+        player = characters.Player(self.sprite('player'), **header.get('player', {}))
+        world = World(background, player, self.engine, floor=header.get('floor', 0))
+        world.medkit = self.sprite('medkit')
+        if 'goal' in header:
+            goal = header['goal']
+            image = self.sprite(goal.get('sprite', 'goal'))
+            world.goal = (image, (goal['x'], world.height - goal['y'] - image.height))
+
+        world.level = self
+        self.world = world
+        self.update()
+        return world
+
+    def update(self):
+        # Stream in and wake up the chunks around the camera, put the rest to sleep
+        world = self.world
+        first = max(0, int(world.x - self.active_margin) // self.chunk_width)
+        last = int(world.x + self.engine.width + self.active_margin) // self.chunk_width
+        self.stream_to(last)
+        self.activate(first, last)
+
+    def stream_to(self, last):
+        while self.level_file is not None and (not self.chunks or self.chunks[-1].index < last):
+            line = self.level_file.readline()
+            if not line:
+                self.level_file.close()
+                self.level_file = None
+            elif line.strip():
+                self.load_chunk(json.loads(line))
+
+    def load_chunk(self, data):
+        world = self.world
+        chunk = Chunk(data['chunk'])
+        for entry in data.get('enemies', ()):
+            kwargs = dict(entry)
+            kwargs['image'] = self.sprite(kwargs.pop('sprite', 'enemy'))
+            if 'detected_sprite' in kwargs:
+                kwargs['detected_image'] = self.sprite(kwargs.pop('detected_sprite'))
+            chunk.enemies.append(characters.PatrollingEnemy(**kwargs))
+            chunk.spawns.append(((), kwargs))
+        for entry in data.get('statics', ()):
+            if 'color' in entry:
+                entry['color'] = tuple(entry['color'])
+            world.add_static(StaticRect(**entry))
+        for x, y in data.get('medkits', ()):
+            coords = (x, world.height - y - world.medkit.height)
+            chunk.medkits.append(coords)
+            world.add_medkit(coords)
+
+        self.chunks.append(chunk)
+        self.enemies.extend(chunk.enemies)
+
+    def activate(self, first, last):
+        if (first, last) == self.active:
+            return
+        self.active = (first, last)
+        for chunk in self.chunks:
+            wanted = first <= chunk.index <= last
+            if wanted == chunk.active:
+                continue
+            chunk.active = wanted
+            for enemy in chunk.enemies:
+                if wanted:
+                    self.world.add_enemy(enemy)
+                else:
+                    self.world.remove_enemy(enemy, recycle=False)
+
+    def snapshot(self):
+        return (len(self.chunks), self.active)
+
+    def restore(self, state):
+        # Chunks streamed in after the snapshot are kept, but back in their initial state
+        loaded, active = state
+        self.active = None
+        self.activate(*active)
+        for chunk in self.chunks[loaded:]:
+            chunk.reset()
+            if chunk.active:
+                for enemy in chunk.enemies:
+                    self.world.enemy_index.update(enemy, enemy.x, enemy.y, enemy.width, enemy.height)
+
+    def restore_medkits(self, state):
+        for chunk in self.chunks[state[0]:]:
+            for coords in chunk.medkits:
+                self.world.add_medkit(coords)
+
+
+def load_level(path, engine, active_margin=None):
+    return Level(path, engine, active_margin).build_world()
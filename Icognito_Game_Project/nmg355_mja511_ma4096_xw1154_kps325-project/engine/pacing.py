@@ -0,0 +1,103 @@
+import collections, logging
+from timeit import default_timer as timer
+
+# Quality levels, from everything drawn to the cheapest frames
+FULL = 0
+NO_OFFSCREEN_ENEMIES = 1 # Enemies outside the viewport no longer cast vision outlines into it
+NO_VISION = 2 # No vision outlines at all
+SLOW_HUD = 3 # The HUD is only refreshed every hud_interval frames
+LEVELS = ('full', 'no off-screen enemies', 'no vision outlines', 'slow hud')
+
+class FramePacer(object):
+    # Times the work in each frame, everything but the wait for the frame
+    # cap, and predicts the next frame as the running mean plus twice the
+    # running deviation, so that jittery frames count as well as slow ones.
+    # When the prediction overruns `high` of the frame budget the quality
+    # drops a level. It comes back a level once the prediction has been under
+    # `low` of the budget for recover_frames frames with no overrun in
+    # between. Changes are at least cooldown frames apart so one slow frame
+    # does not make it flap.
+    def __init__(self, fps=60, high=0.9, low=0.6, cooldown=30, recover_frames=120, hud_interval=6, history=100):
+        self.budget = 1000.0 / fps
+        self.high = high
+        self.low = low
+        self.cooldown = cooldown
+        self.recover_frames = recover_frames
+        self.hud_interval = hud_interval
+
+        self.level = FULL
+        self.pinned = None
+        self.mean = 0.0
+        self.deviation = 0.0
+        self.frames = 0
+        self.last_change = 0
+        self.headroom_frames = 0
+        self.hud_frames = 0
+        # (frame, old level, new level, predicted ms) for every change
+        self.changes = collections.deque(maxlen=history)
+        self._start = None
+
+    @property
+    def predicted(self):
+        return self.mean + 2 * self.deviation
+
+    @property
+    def offscreen_enemies(self):
+        return self.level < NO_OFFSCREEN_ENEMIES
+
+    @property
+    def vision_outlines(self):
+        return self.level < NO_VISION
+
+    def hud_due(self):
+        # Whether the HUD should be redrawn this frame
+        self.hud_frames += 1
+        if self.level < SLOW_HUD or self.hud_frames >= self.hud_interval:
+            self.hud_frames = 0
+            return True
+        return False
+
+    def pin(self, level=None):
+        # Hold a quality level, e.g. from a settings menu. None goes back to adapting.
+        self.pinned = level
+        if level is not None:
+            self.set_level(level)
+
+    def set_level(self, level):
+        if level != self.level:
+            self.changes.append((self.frames, self.level, level, self.predicted))
+            logging.info('Frame pacing: {} ({:.1f} ms predicted, {:.1f} ms budget)'.format(LEVELS[level], self.predicted, self.budget))
+            self.level = level
+            self.last_change = self.frames
+
+    def begin(self):
+        self._start = timer()
+
+    def end(self):
+        # Call once the frame's work is done, before waiting for the frame cap
+        if self._start is not None:
+            self.frame((timer() - self._start) * 1000)
+            self._start = None
+
+    def frame(self, ms):
+        # Feed one frame's work time and adapt the quality level to it
+        self.frames += 1
+        if self.frames == 1:
+            self.mean = ms
+        self.deviation += 0.1 * (abs(ms - self.mean) - self.deviation)
+        self.mean += 0.1 * (ms - self.mean)
+
+        predicted = self.predicted
+        if predicted < self.budget * self.low:
+            self.headroom_frames += 1
+        elif predicted > self.budget * self.high:
+            self.headroom_frames = 0
+
+        if self.pinned is not None or self.frames - self.last_change < self.cooldown:
+            return self.level
+        if predicted > self.budget * self.high and self.level < SLOW_HUD:
+            self.set_level(self.level + 1)
+        elif self.headroom_frames >= self.recover_frames and self.level > FULL:
+            self.set_level(self.level - 1)
+            self.headroom_frames = 0
+        return self.level
@@ -0,0 +1,54 @@
+class EntityPool(object):
+    # Active entities are kept in a dense list and each one remembers its
+    # slot in _pool_index, so despawning is a swap with the last entity
+    # instead of a list.remove. Despawned objects go on a free list and are
+    # re-initialised by the next spawn instead of allocating a new one.
+    def __init__(self, cls, capacity=0):
+        self.cls = cls
+        self.active = []
+        self.free = [cls.__new__(cls) for _ in xrange(capacity)]
+
+    def __len__(self):
+        return len(self.active)
+
+    def __iter__(self):
+        return iter(self.active)
+
+    def __getitem__(self, index):
+        return self.active[index]
+
+    def __contains__(self, entity):
+        index = getattr(entity, '_pool_index', -1)
+        return 0 <= index < len(self.active) and self.active[index] is entity
+
+    def add(self, entity):
+        # Track an entity that was constructed elsewhere
+        entity._pool_index = len(self.active)
+        self.active.append(entity)
+        return entity
+
+    def spawn(self, *args, **kwargs):
+        entity = self.free.pop() if self.free else self.cls.__new__(self.cls)
+        entity.__init__(*args, **kwargs)
+        return self.add(entity)
+
+    def remove(self, entity):
+        # Stop tracking an entity without handing it back for reuse
+        if entity not in self:
+            raise ValueError('Entity is not active in this pool')
+        index = entity._pool_index
+        last = self.active.pop()
+        if last is not entity:
+            self.active[index] = last
+            last._pool_index = index
+        entity._pool_index = -1
+
+    def despawn(self, entity):
+        self.remove(entity)
+        self.free.append(entity)
+
+    def clear(self):
+        for entity in self.active:
+            entity._pool_index = -1
+        self.free.extend(self.active)
+        self.active = []
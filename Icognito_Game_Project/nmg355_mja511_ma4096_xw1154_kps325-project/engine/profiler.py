@@ -0,0 +1,68 @@
+import collections, json, logging
+from timeit import default_timer as timer
+
+class FrameProfiler(object):
+    # Per-phase frame timings (ms) for the last `size` frames. The engine
+    # calls begin() at the top of a frame, mark(phase) after each phase and
+    # end() once the frame has been presented. The wait for the frame cap is
+    # its own phase and is left out of the frame time. Input latency, from a
+    # key press being read to the first frame presented after it, is kept
+    # apart since most frames have none.
+    PHASES = ('events', 'handlers', 'tick', 'render', 'hud', 'present', 'wait')
+
+    def __init__(self, size=600, path=None, overlay=False):
+        self.frames = collections.deque(maxlen=size)
+        self.latencies = collections.deque(maxlen=size)
+        self.path = path
+        self.overlay = overlay
+        self._current = None
+        self._start = self._last = 0
+
+    def begin(self):
+        self._current = dict.fromkeys(self.PHASES, 0.0)
+        self._start = self._last = timer()
+
+    def mark(self, phase):
+        now = timer()
+        self._current[phase] += (now - self._last) * 1000
+        self._last = now
+
+    def end(self):
+        self._current['frame'] = (timer() - self._start) * 1000 - self._current['wait']
+        self.frames.append(self._current)
+
+    def latency(self, ms):
+        self.latencies.append(ms)
+
+    def percentiles(self, phase='frame', points=(50, 95, 99)):
+        if phase == 'latency':
+            samples = sorted(self.latencies)
+        else:
+            samples = sorted(frame[phase] for frame in self.frames)
+        if not samples:
+            return dict.fromkeys(points, 0.0)
+        return dict((point, samples[min(len(samples) - 1, len(samples) * point // 100)]) for point in points)
+
+    def draw(self, surface):
+        from core import text_cache
+        stats = self.percentiles()
+        text = 'frame p50 {:.1f}  p95 {:.1f}  p99 {:.1f} ms'.format(stats[50], stats[95], stats[99])
+        if self.latencies:
+            text += '  input p95 {:.1f} ms'.format(self.percentiles('latency')[95])
+        return surface.blit(text_cache.font(None, 24).render(text, 1, (255, 255, 0)), (10, 10))
+
+    def dump(self, path=None):
+        path = path or self.path
+        columns = self.PHASES + ('frame',)
+        with open(path, 'w') as dump_file:
+            if path.lower().endswith('.json'):
+                json.dump({
+                    'frames': list(self.frames),
+                    'percentiles': dict((phase, self.percentiles(phase)) for phase in columns + ('latency',)),
+                    'input_latency': list(self.latencies),
+                }, dump_file)
+            else:
+                dump_file.write(','.join(columns) + '\n')
+                for frame in self.frames:
+                    dump_file.write(','.join('{:.3f}'.format(frame[phase]) for phase in columns) + '\n')
+        logging.info('Wrote {} frame timings to {}'.format(len(self.frames), path))
@@ -0,0 +1,45 @@
+import threading
+
+class RenderThread(threading.Thread):
+    # Draws and presents the frames the simulation publishes. Captured frames
+    # are immutable, so double buffering only takes two references: the front
+    # frame being drawn and the newest frame published behind it. A frame
+    # published while the back slot is still full replaces it, so a slow
+    # display drops frames instead of holding up the simulation. Blits and
+    # display updates release the GIL, so the two threads really overlap.
+    def __init__(self, engine, world):
+        threading.Thread.__init__(self, name='render')
+        self.daemon = True
+        self.engine = engine
+        self.world = world
+        self.condition = threading.Condition()
+        self.back = None
+        self.running = True
+        self.published = 0
+        self.drawn = 0
+
+    def publish(self, frame):
+        with self.condition:
+            self.back = frame
+            self.published += 1
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.back is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                front, self.back = self.back, None
+            if self.engine.pacer:
+                self.engine.pacer.begin()
+            self.engine.flip(self.engine.draw_frame(self.world, front))
+            self.drawn += 1
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
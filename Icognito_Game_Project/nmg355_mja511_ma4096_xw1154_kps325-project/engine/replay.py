@@ -0,0 +1,122 @@
+import struct, logging
+
+# Input logs store one bitmask of held keys per simulation step:
+#   'INCR' | version (B) | key count (H) | key codes (I each) | masks
+# Key codes are 32-bit since pygame 2 codes like K_RIGHT do not fit in 16.
+MAGIC = b'INCR'
+VERSION = 2
+
+class InputLog(object):
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.bits = dict((key, 1 << i) for i, key in enumerate(self.keys))
+        self.frame_size = (len(self.keys) + 7) // 8
+        self.data = bytearray()
+
+    def __len__(self):
+        return len(self.data) // self.frame_size if self.frame_size else 0
+
+    def append(self, held):
+        mask = 0
+        for key in held:
+            mask |= self.bits.get(key, 0)
+        for i in xrange(self.frame_size):
+            self.data.append((mask >> (8 * i)) & 0xff)
+
+    def frame(self, index):
+        start = index * self.frame_size
+        if start >= len(self.data):
+            return frozenset()
+        mask = 0
+        for i in xrange(self.frame_size):
+            mask |= self.data[start + i] << (8 * i)
+        return frozenset(key for key in self.keys if mask & self.bits[key])
+
+    def save(self, path):
+        with open(path, 'wb') as log_file:
+            log_file.write(MAGIC + struct.pack('<BH', VERSION, len(self.keys)))
+            log_file.write(struct.pack('<{}I'.format(len(self.keys)), *self.keys))
+            log_file.write(self.data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as log_file:
+            data = log_file.read()
+        if data[:4] != MAGIC:
+            raise ValueError('Not an input log: {}'.format(path))
+        version, count = struct.unpack_from('<BH', data, 4)
+        if version != VERSION:
+            raise ValueError('Unsupported input log version {}'.format(version))
+        log = cls(struct.unpack_from('<{}I'.format(count), data, 7))
+        log.data = bytearray(data[7 + 4 * count:])
+        return log
+
+
+class RecordingInput(object):
+    # Passes another input source through while logging what it returns
+    def __init__(self, source, path=None):
+        self.source = source
+        self.path = path
+        self.log = None
+
+    def poll(self, keys):
+        if self.log is None:
+            self.log = InputLog(keys)
+        held = self.source.poll(keys)
+        self.log.append(held)
+        return held
+
+    def save(self, path=None):
+        if self.log is not None:
+            self.log.save(path or self.path)
+            logging.info('Saved {} frames of input to {}'.format(len(self.log), path or self.path))
+
+
+class ReplayInput(object):
+    def __init__(self, log):
+        self.log = log
+        self.frame = 0
+
+    def poll(self, keys):
+        held = self.log.frame(self.frame)
+        self.frame += 1
+        return held
+
+
+class Replay(object):
+    # Re-simulates a recorded session without drawing. A world snapshot is
+    # kept every snapshot_interval frames so seek() only replays the tail.
+    # The keys held going into a snapshot are kept with it, since press and
+    # release handlers fire on changes from them.
+    def __init__(self, engine, world, log, snapshot_interval=600):
+        self.engine = engine
+        self.world = world
+        self.input = ReplayInput(log)
+        self.snapshot_interval = snapshot_interval
+        self.frame = 0
+
+        engine.input = self.input
+        engine.populate(world)
+        engine.outcome = None
+        engine.keys_down = frozenset()
+        self.snapshots = {0: (world.snapshot(), None, engine.keys_down)}
+
+    def advance(self, frames):
+        target = self.frame + frames
+        while self.frame < target and self.engine.outcome is None:
+            self.engine.step(self.world)
+            self.frame += 1
+            if self.frame % self.snapshot_interval == 0 and self.frame not in self.snapshots:
+                self.snapshots[self.frame] = (self.world.snapshot(), self.engine.outcome, self.engine.keys_down)
+        return self.engine.outcome
+
+    def run(self):
+        # Play to the end of the log or until the episode is decided
+        return self.advance(len(self.input.log) - self.frame)
+
+    def seek(self, frame):
+        start = max(f for f in self.snapshots if f <= frame)
+        state, self.engine.outcome, self.engine.keys_down = self.snapshots[start]
+        self.world.restore(state)
+        self.frame = self.input.frame = start
+        return self.advance(frame - start)
@@ -0,0 +1,103 @@
+import sys, random, logging, itertools, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from pygame.locals import *
+from core import Engine
+from controls import PolicyInput
+
+# (held keys, weight) the random bot picks between
+ACTIONS = [
+    ((K_RIGHT,), 60),
+    ((K_RIGHT, K_UP), 15),
+    ((K_DOWN,), 10),
+    ((K_LEFT,), 10),
+    ((), 5),
+]
+
+
+def random_policy(seed):
+    # Holds a randomly chosen action for a random number of frames
+    rng = random.Random(seed)
+    total = sum(weight for _, weight in ACTIONS)
+    state = {'until': 0, 'keys': ()}
+
+    def policy(frame):
+        if frame >= state['until']:
+            pick = rng.uniform(0, total)
+            for keys, weight in ACTIONS:
+                pick -= weight
+                if pick <= 0:
+                    break
+            state['keys'] = keys
+            state['until'] = frame + rng.randint(10, 60)
+        return state['keys']
+    return policy
+
+
+def default_world(engine):
+    import game
+    return game.build_world(engine)
+
+
+def play_episode(seed, build_world=default_world, max_frames=20000):
+    # Runs in a worker process, so everything is built from scratch
+    engine = Engine(1280, 720, headless=True, input_source=PolicyInput(random_policy(seed)))
+    world = build_world(engine)
+    return seed, engine.run(world, max_frames)
+
+
+class Summary(object):
+    def __init__(self):
+        self.episodes = 0
+        self.wins = 0
+        self.detections = []
+        self.finish_frames = []
+
+    def add(self, result):
+        self.episodes += 1
+        if result.outcome == Engine.WIN:
+            self.wins += 1
+            self.finish_frames.append(result.frames)
+        if result.detected_at is not None:
+            self.detections.append(result.detected_at)
+
+    @property
+    def win_rate(self):
+        return float(self.wins) / self.episodes if self.episodes else 0.0
+
+    @property
+    def mean_finish(self):
+        return float(sum(self.finish_frames)) / len(self.finish_frames) if self.finish_frames else None
+
+    def __str__(self):
+        return '{} episodes, win rate {:.1%}, {} detections, mean finish {} frames'.format(
+            self.episodes, self.win_rate, len(self.detections), self.mean_finish)
+
+
+def run_episodes(seeds, build_world=default_world, max_frames=20000, workers=None):
+    # Yields (seed, result, summary so far) as episodes finish on any core.
+    # Only two episodes per worker are queued at a time, so seeds can be a
+    # lazy iterable of any length.
+    summary = Summary()
+    workers = workers or multiprocessing.cpu_count()
+    seeds = iter(seeds)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set(executor.submit(play_episode, seed, build_world, max_frames)
+                      for seed in itertools.islice(seeds, 2 * workers))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for seed in itertools.islice(seeds, len(done)):
+                pending.add(executor.submit(play_episode, seed, build_world, max_frames))
+            for future in done:
+                seed, result = future.result()
+                summary.add(result)
+                yield seed, result, summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    episodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    summary = Summary()
+    for seed, result, summary in run_episodes(xrange(episodes)):
+        logging.info('Seed {}: {}'.format(seed, result))
+    print(summary)
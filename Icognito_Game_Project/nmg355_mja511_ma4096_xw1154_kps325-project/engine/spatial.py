@@ -0,0 +1,77 @@
+import collections
+
+class SpatialGrid(object):
+    # Uniform grid that buckets items by the cells their bounding box covers.
+    # Queries return candidates in insertion order so that anything iterating
+    # them behaves the same as iterating the original list.
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(set)
+        # Cell range (x0, y0, x1, y1) of every item, read-only outside the grid
+        self.ranges = {}
+        self._order = {}
+        self._counter = 0
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __contains__(self, item):
+        return item in self.ranges
+
+    def _cell_range(self, x, y, width, height):
+        size = self.cell_size
+        return (int(x // size), int(y // size), int((x + width) // size), int((y + height) // size))
+
+    def _add_cells(self, item, cell_range):
+        x0, y0, x1, y1 = cell_range
+        for cx in xrange(x0, x1 + 1):
+            for cy in xrange(y0, y1 + 1):
+                self.cells[(cx, cy)].add(item)
+
+    def _remove_cells(self, item, cell_range):
+        x0, y0, x1, y1 = cell_range
+        for cx in xrange(x0, x1 + 1):
+            for cy in xrange(y0, y1 + 1):
+                cell = self.cells[(cx, cy)]
+                cell.discard(item)
+                if not cell:
+                    del self.cells[(cx, cy)]
+
+    def insert(self, item, x, y, width, height):
+        if item in self.ranges:
+            self.remove(item)
+        cell_range = self._cell_range(x, y, width, height)
+        self.ranges[item] = cell_range
+        self._order[item] = self._counter
+        self._counter += 1
+        self._add_cells(item, cell_range)
+
+    def remove(self, item):
+        self._remove_cells(item, self.ranges.pop(item))
+        del self._order[item]
+
+    def update(self, item, x, y, width, height):
+        # Cheap when the item stays inside the same cells, which is most frames
+        size = self.cell_size
+        cell_range = (int(x // size), int(y // size), int((x + width) // size), int((y + height) // size))
+        old_range = self.ranges[item]
+        if cell_range != old_range:
+            self._remove_cells(item, old_range)
+            self._add_cells(item, cell_range)
+            self.ranges[item] = cell_range
+
+    def query(self, x, y, width, height, ordered=True):
+        x0, y0, x1, y1 = self._cell_range(x, y, width, height)
+        found = set()
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            for cell in self.cells.values():
+                found.update(cell)
+        else:
+            for cx in xrange(x0, x1 + 1):
+                for cy in xrange(y0, y1 + 1):
+                    cell = self.cells.get((cx, cy))
+                    if cell:
+                        found.update(cell)
+        if not ordered:
+            return found
+        return sorted(found, key=self._order.__getitem__)